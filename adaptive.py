@@ -0,0 +1,208 @@
+import numpy as np
+
+from bitio import BitReader, BitWriter
+from fastlimits import FastMBitLimits
+from tracing import CodingCounters
+
+RESCALE_LIMIT = 2**16
+CONTEXT_SIZE = 8
+
+
+class AdaptiveMBitLimits(FastMBitLimits):
+    """
+    Execute arithmetic coding with counts learned while coding.
+
+    Both encoder and decoder start from a count of one for every window
+    of (order + 1) bits, the same table _initialize_dict creates, and
+    add one to the count of each window right after coding its last
+    bit. Since the decoder updates its counts exactly as the encoder
+    does, no count table has to be sent and the message is read only
+    once. Whenever the total count of a context goes over the rescale
+    limit, both counts of that context are halved, which keeps the
+    word length fixed and lets the model follow changes in the data.
+    Counters only add up the symbols, the coded bits and the time spent.
+    """
+    rescale_limit: int
+
+    def __init__(self, markov_order: int, rescale_limit: int = RESCALE_LIMIT,
+                 counters: CodingCounters|None = None) -> None:
+        super().__init__(markov_order, np.ones(2**(markov_order + 1), dtype=np.int64), counters=counters)
+        self.word_length = int(2 + np.ceil(np.log2(rescale_limit)))
+        self.rescale_limit = rescale_limit
+        self.restart()
+
+    @property
+    def counts(self) -> np.ndarray:
+        """Return the current occurrence counts."""
+        counts = np.empty(2**(self.markov_order + 1), dtype=np.int64)
+        counts[0::2] = self.zero_counts
+        counts[1::2] = np.subtract(self.total_counts, self.zero_counts)
+        return counts
+
+    def state(self) -> bytes:
+        """
+        Return the state of the model, so coding can be resumed later.
+
+        The state is the context, in CONTEXT_SIZE bytes, and the counts
+        of zeros and the total counts of every context, each as a big
+        endian 32 bit integer. The limits are not part of it, since they
+        are restarted for every segment.
+        """
+        return b''.join((self.context.to_bytes(CONTEXT_SIZE, 'big'),
+                         np.asarray(self.zero_counts, dtype='>u4').tobytes(),
+                         np.asarray(self.total_counts, dtype='>u4').tobytes()))
+
+    def restore_state(self, state: bytes) -> None:
+        """Resume the model from a state returned by state."""
+        counts = np.frombuffer(state, dtype='>u4', offset=CONTEXT_SIZE)
+        if counts.size != 2*len(self.zero_counts):
+            raise ValueError('The state is not one of a model of this order.')
+        self.context = int.from_bytes(state[:CONTEXT_SIZE], 'big')
+        self.zero_counts, self.total_counts = counts.reshape(2, -1).tolist()
+
+    def encode_bits(self, bit_array: np.ndarray, writer: BitWriter) -> None:
+        """
+        Encode bits without ending the encoded message.
+
+        The counts are updated after every bit, and the limits, the
+        context and the E_3 mapping counter are kept between calls.
+        """
+        write_bit = writer.write_bit
+        write_run = writer.write_run
+        zero_counts = self.zero_counts
+        total_counts = self.total_counts
+        rescale_limit = self.rescale_limit
+        context_mask = (1 << self.markov_order) - 1
+        mask = (1 << self.word_length) - 1
+        half = 1 << (self.word_length - 1)
+        quarter = 1 << (self.word_length - 2)
+        three_quarters = half + quarter
+        lower, upper, context = self.lower, self.upper, self.context
+        e_3_counter = self.e_3_mapping_counter
+        for bit in bit_array.tolist():
+            zero_count = zero_counts[context]
+            total = total_counts[context]
+            factor = upper - lower + 1
+            split = factor*zero_count//total
+            if bit:
+                lower += split
+            else:
+                upper = lower + split - 1
+                zero_count += 1
+            total += 1
+            if total > rescale_limit:
+                one_count = total - zero_count
+                zero_count = (zero_count + 1) >> 1
+                total = zero_count + ((one_count + 1) >> 1)
+            zero_counts[context] = zero_count
+            total_counts[context] = total
+            context = ((context << 1) | bit) & context_mask
+            while True:
+                if upper < half:
+                    write_bit(0)
+                    lower = lower << 1
+                    upper = (upper << 1) | 1
+                    if e_3_counter:
+                        write_run(1, e_3_counter)
+                        e_3_counter = 0
+                elif lower >= half:
+                    write_bit(1)
+                    lower = (lower << 1) & mask
+                    upper = ((upper << 1) & mask) | 1
+                    if e_3_counter:
+                        write_run(0, e_3_counter)
+                        e_3_counter = 0
+                elif lower >= quarter and upper < three_quarters:
+                    lower = ((lower << 1) & mask) ^ half
+                    upper = (((upper << 1) & mask) | 1) ^ half
+                    e_3_counter += 1
+                else:
+                    break
+        self.lower, self.upper, self.context = lower, upper, context
+        self.e_3_mapping_counter = e_3_counter
+
+    def decode(self, bits: np.ndarray|BitReader, symbol_count: int|None = None) -> np.ndarray:
+        """
+        Return decoded message.
+
+        Decoding stops after symbol_count bits, which has to be given,
+        since there is no count table to infer it from.
+        """
+        if symbol_count is None:
+            raise ValueError('Adaptive decoding needs the amount of bits to decode.')
+        return super().decode(bits, symbol_count)
+
+    def decode_bits(self, bits: BitReader, symbol_count: int) -> np.ndarray:
+        """
+        Decode symbol_count bits, updating the counts after every bit.
+
+        The tag is read from the start of bits.
+        """
+        decoded_message = BitWriter()
+        write_bit = decoded_message.write_bit
+        read_bit = bits.read_bit
+        zero_counts = self.zero_counts
+        total_counts = self.total_counts
+        rescale_limit = self.rescale_limit
+        context_mask = (1 << self.markov_order) - 1
+        mask = (1 << self.word_length) - 1
+        half = 1 << (self.word_length - 1)
+        quarter = 1 << (self.word_length - 2)
+        three_quarters = half + quarter
+        tag = bits.read_int(self.word_length)
+        lower, upper, context = self.lower, self.upper, self.context
+        for _ in range(symbol_count):
+            zero_count = zero_counts[context]
+            total = total_counts[context]
+            factor = upper - lower + 1
+            split = factor*zero_count//total
+            if ((tag - lower + 1)*total - 1)//factor < zero_count:
+                bit = 0
+                upper = lower + split - 1
+                zero_count += 1
+            else:
+                bit = 1
+                lower += split
+            write_bit(bit)
+            total += 1
+            if total > rescale_limit:
+                one_count = total - zero_count
+                zero_count = (zero_count + 1) >> 1
+                total = zero_count + ((one_count + 1) >> 1)
+            zero_counts[context] = zero_count
+            total_counts[context] = total
+            context = ((context << 1) | bit) & context_mask
+            while True:
+                if upper < half:
+                    lower = lower << 1
+                    upper = (upper << 1) | 1
+                    tag = ((tag << 1) & mask) | read_bit()
+                elif lower >= half:
+                    lower = (lower << 1) & mask
+                    upper = ((upper << 1) & mask) | 1
+                    tag = ((tag << 1) & mask) | read_bit()
+                elif lower >= quarter and upper < three_quarters:
+                    lower = ((lower << 1) & mask) ^ half
+                    upper = (((upper << 1) & mask) | 1) ^ half
+                    tag = (((tag << 1) & mask) | read_bit()) ^ half
+                else:
+                    break
+        self.tag, self.lower, self.upper, self.context = tag, lower, upper, context
+        return decoded_message.to_array()
+
+
+def decode_segments(reader: BitReader, limits: AdaptiveMBitLimits) -> np.ndarray:
+    """
+    Return the bits of the segments left in reader.
+
+    Each segment is the amount of bits it encodes, as a varint, and its
+    encoded message, padded to a whole byte. The limits are restarted
+    for every segment, but the counts and the context carry on, and an
+    empty segment marks the end.
+    """
+    segments = []
+    while symbol_count := reader.read_varint():
+        limits.restart()
+        segments.append(limits.decode(reader, symbol_count))
+        reader.align()
+    return np.concatenate(segments) if segments else np.zeros(0, dtype=np.int8)
@@ -0,0 +1,210 @@
+import numpy as np
+
+BYTE_SIZE = 8
+
+
+class BitWriter:
+    """
+    Accumulate bits into packed bytes.
+
+    Bits are written most significant first, the same way they appear
+    in the strings of bits used throughout the algorithm, but they are
+    kept packed in a bytearray, so each written bit costs one eighth of
+    a byte of memory instead of a whole character.
+    """
+    buffer: bytearray
+    accumulator: int
+    pending: int
+    drained: int
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.accumulator = 0
+        self.pending = 0
+        self.drained = 0
+
+    def __len__(self) -> int:
+        """Return the amount of bits written so far."""
+        return BYTE_SIZE*(self.drained + len(self.buffer)) + self.pending
+
+    @property
+    def padding_number(self) -> int:
+        """Return the amount of bits needed to complete the last byte."""
+        return (BYTE_SIZE - self.pending) % BYTE_SIZE
+
+    def write_bit(self, bit: int) -> None:
+        """Write a single bit."""
+        self.accumulator = (self.accumulator << 1) | bit
+        self.pending += 1
+        if self.pending == BYTE_SIZE:
+            self.buffer.append(self.accumulator)
+            self.accumulator = 0
+            self.pending = 0
+
+    def write_int(self, value: int, width: int) -> None:
+        """Write the binary digits of value using width bits."""
+        self.accumulator = (self.accumulator << width) | value
+        self.pending += width
+        while self.pending >= BYTE_SIZE:
+            self.pending -= BYTE_SIZE
+            self.buffer.append((self.accumulator >> self.pending) & 0xFF)
+        self.accumulator &= (1 << self.pending) - 1
+
+    def write_run(self, bit: int, count: int) -> None:
+        """Write the same bit count times."""
+        while count and self.pending:
+            self.write_bit(bit)
+            count -= 1
+        full_bytes, remainder = divmod(count, BYTE_SIZE)
+        self.buffer.extend((0xFF if bit else 0x00,)*full_bytes)
+        for _ in range(remainder):
+            self.write_bit(bit)
+
+    def write_array(self, bit_array: np.ndarray) -> None:
+        """Write every bit of an array of bits."""
+        bit_array = np.asarray(bit_array)
+        head = min((BYTE_SIZE - self.pending) % BYTE_SIZE, bit_array.size)
+        for bit in bit_array[:head].tolist():
+            self.write_bit(bit)
+        body = bit_array[head:]
+        aligned = body.size - body.size % BYTE_SIZE
+        self.buffer.extend(np.packbits(body[:aligned].astype(np.uint8)).tobytes())
+        for bit in body[aligned:].tolist():
+            self.write_bit(bit)
+
+    def write_bytes(self, data: bytes) -> None:
+        """Write every bit of some bytes."""
+        if self.pending:
+            self.write_int(int.from_bytes(data, 'big'), BYTE_SIZE*len(data))
+        else:
+            self.buffer.extend(data)
+
+    def write_varint(self, value: int) -> None:
+        """
+        Write a non-negative integer as a variable length quantity.
+
+        Seven bits of the value go in each byte, least significant
+        first, and the left most bit of every byte but the last is one.
+        """
+        while value >= 0x80:
+            self.write_int((value & 0x7F) | 0x80, BYTE_SIZE)
+            value >>= 7
+        self.write_int(value, BYTE_SIZE)
+
+    def pad(self) -> int:
+        """Complete the last byte with zeros and return how many were used."""
+        padding_number = self.padding_number
+        if padding_number:
+            self.write_int(0, padding_number)
+        return padding_number
+
+    def drain(self) -> bytes:
+        """
+        Remove and return the complete bytes written so far.
+
+        The bits of an incomplete last byte are kept, so writing can go
+        on as if nothing had been removed.
+        """
+        complete_bytes = bytes(self.buffer)
+        self.drained += len(self.buffer)
+        self.buffer.clear()
+        return complete_bytes
+
+    def to_bytes(self) -> bytes:
+        """Return bits not drained yet as bytes, padding the last byte with zeros."""
+        if not self.pending:
+            return bytes(self.buffer)
+        last_byte = self.accumulator << (BYTE_SIZE - self.pending)
+        return b''.join((self.buffer, bytes((last_byte,))))
+
+    def to_array(self) -> np.ndarray:
+        """Return bits not drained yet as an array of bits."""
+        packed = np.frombuffer(self.to_bytes(), dtype=np.uint8)
+        return np.unpackbits(packed, count=BYTE_SIZE*len(self.buffer) + self.pending).view(np.int8)
+
+
+class BitReader:
+    """
+    Read bits out of packed bytes.
+
+    Bits are read most significant first, which is the order used by
+    BitWriter, so whatever one of them writes the other reads back.
+    """
+    data: bytes
+    bit_length: int
+    position: int
+
+    def __init__(self, data: bytes, bit_length: int|None = None) -> None:
+        self.data = bytes(data)
+        if bit_length is None:
+            bit_length = BYTE_SIZE*len(self.data)
+        self.bit_length = bit_length
+        self.position = 0
+
+    @classmethod
+    def from_array(cls, bit_array: np.ndarray) -> 'BitReader':
+        """Create a reader over the bits of an array of bits."""
+        bit_array = np.asarray(bit_array)
+        return cls(np.packbits(bit_array.astype(np.uint8)).tobytes(), bit_array.size)
+
+    @property
+    def remaining(self) -> int:
+        """Return the amount of bits not read yet."""
+        return self.bit_length - self.position
+
+    def read_bit(self) -> int:
+        """Read a single bit."""
+        position = self.position
+        if position >= self.bit_length:
+            raise EOFError('No bits left to read.')
+        self.position = position + 1
+        return (self.data[position >> 3] >> (7 - (position & 7))) & 1
+
+    def read_int(self, width: int) -> int:
+        """Read width bits and return them as the digits of an integer."""
+        if width > self.remaining:
+            raise EOFError('Not enough bits left to read.')
+        start = self.position >> 3
+        end = (self.position + width + BYTE_SIZE - 1) >> 3
+        chunk = int.from_bytes(self.data[start:end], 'big')
+        trailing_bits = BYTE_SIZE*(end - start) - (self.position & 7) - width
+        self.position += width
+        return (chunk >> trailing_bits) & ((1 << width) - 1)
+
+    def read_bytes(self, count: int) -> bytes:
+        """Read count bytes worth of bits."""
+        if self.position % BYTE_SIZE:
+            return self.read_int(BYTE_SIZE*count).to_bytes(count, 'big')
+        if BYTE_SIZE*count > self.remaining:
+            raise EOFError('Not enough bits left to read.')
+        start = self.position >> 3
+        self.position += BYTE_SIZE*count
+        return self.data[start:start+count]
+
+    def read_varint(self) -> int:
+        """Read a non-negative integer written by BitWriter.write_varint."""
+        value = 0
+        shift = 0
+        while True:
+            byte = self.read_int(BYTE_SIZE)
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def align(self) -> int:
+        """Skip the bits left in the current byte and return how many."""
+        skipped = (BYTE_SIZE - self.position % BYTE_SIZE) % BYTE_SIZE
+        self.position += skipped
+        return skipped
+
+    def read_array(self, count: int) -> np.ndarray:
+        """Read count bits and return them as an array of bits."""
+        if count > self.remaining:
+            raise EOFError('Not enough bits left to read.')
+        start = self.position >> 3
+        end = (self.position + count + BYTE_SIZE - 1) >> 3
+        packed = np.frombuffer(self.data[start:end], dtype=np.uint8)
+        offset = self.position & 7
+        self.position += count
+        return np.unpackbits(packed)[offset:offset+count].view(np.int8)
@@ -0,0 +1,178 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import read as r
+from bitio import BitReader, BitWriter
+from encode import write_container_header, write_count_table
+from hotlimits import HotMBitLimits
+from occurrences import occurrence_counts
+
+BLOCK_SIZE = 2**20
+
+_shared_limits: HotMBitLimits|None = None
+
+
+def _jobs(jobs: int|None, job_count: int) -> int:
+    """Return how many processes are worth using for job_count jobs."""
+    return max(min(jobs or os.cpu_count() or 1, job_count), 1)
+
+
+def _share_model(markov_order: int, counts: np.ndarray|None) -> None:
+    """
+    Build the model shared by every block, once per process.
+
+    Without shared occurrence counts every block builds its own model.
+    """
+    global _shared_limits
+    _shared_limits = None if counts is None else HotMBitLimits(markov_order, counts)
+
+
+def _parallel_map(function, arguments: list, jobs: int|None, markov_order: int, counts: np.ndarray|None) -> list:
+    """
+    Apply function to every argument in a process pool.
+
+    A pool is only started if more than one process is worth using, and
+    jobs are sent to it in chunks, so small blocks don't cost a round
+    trip each. The shared model is sent to every process once, when it
+    starts, instead of with every block.
+    """
+    jobs = _jobs(jobs, len(arguments))
+    if jobs == 1:
+        _share_model(markov_order, counts)
+        try:
+            return list(map(function, arguments))
+        finally:
+            _share_model(markov_order, None)
+    with ProcessPoolExecutor(jobs, initializer=_share_model, initargs=(markov_order, counts)) as executor:
+        return list(executor.map(function, arguments, chunksize=max(len(arguments) // (4*jobs), 1)))
+
+
+def _block_limits(markov_order: int, counts: np.ndarray|None) -> HotMBitLimits:
+    """
+    Return the model to code a block with, starting from scratch.
+
+    The shared model is restarted rather than built again, with the
+    context back at zero, since every block is coded on its own.
+    """
+    if counts is not None:
+        return HotMBitLimits(markov_order, counts)
+    _shared_limits.restart()
+    _shared_limits.context = 0
+    return _shared_limits
+
+
+def _encode_block(arguments: tuple[bytes, int]) -> bytes:
+    """
+    Encode a block of data on its own.
+
+    Without a shared model, the block counts its own occurrences and
+    writes them before its encoded message.
+    """
+    block, markov_order = arguments
+    bit_array = np.unpackbits(np.frombuffer(block, dtype=np.uint8)).view(np.int8)
+    writer = BitWriter()
+    counts = None
+    if _shared_limits is None:
+        counts = occurrence_counts(bit_array, markov_order)
+        write_count_table(writer, counts)
+    _block_limits(markov_order, counts).encode(bit_array, writer)
+    return writer.to_bytes()
+
+
+def _decode_block(arguments: tuple[bytes, int, int]) -> bytes:
+    """Decode a block encoded by _encode_block."""
+    block, markov_order, symbol_count = arguments
+    reader = BitReader(block)
+    counts = None
+    if _shared_limits is None:
+        counts = r.read_count_table(reader, markov_order)
+    bit_array = _block_limits(markov_order, counts).decode(reader, symbol_count)
+    return np.packbits(bit_array.view(np.uint8)).tobytes()
+
+
+def encoded_blocks(data: bytes, markov_order: int, block_size: int = BLOCK_SIZE,
+                   shared_model: bool = True, jobs: int|None = None) -> bytes:
+    """
+    Encode data in independent blocks, in parallel.
+
+    Every block of block_size bytes is encoded on its own, either with
+    occurrence counts of the whole data, written once in the header, or
+    with counts of its own, written at the start of the block. After the
+    blocks comes the block index: the amount of blocks, then the byte
+    length and the amount of bits of each one, as varints. The last
+    bytes of the container point to where the index starts.
+    """
+    bit_array = np.unpackbits(np.frombuffer(data, dtype=np.uint8)).view(np.int8)
+    flags = r.FLAG_BLOCKS
+    if shared_model:
+        counts = occurrence_counts(bit_array, markov_order)
+    else:
+        counts = None
+        flags |= r.FLAG_BLOCK_MODELS
+    header = BitWriter()
+    write_container_header(header, markov_order, flags, counts=counts)
+    blocks = [data[i:i+block_size] for i in range(0, len(data), block_size)]
+    encoded = _parallel_map(_encode_block, [(block, markov_order) for block in blocks], jobs, markov_order, counts)
+    index = BitWriter()
+    index.write_varint(len(blocks))
+    for block, encoded_block in zip(blocks, encoded):
+        index.write_varint(len(encoded_block))
+        index.write_varint(r.BYTE_SIZE*len(block))
+    header_bytes = header.to_bytes()
+    index_position = len(header_bytes) + sum(len(encoded_block) for encoded_block in encoded)
+    pointer = index_position.to_bytes(r.INDEX_POINTER_SIZE, 'big')
+    return b''.join((header_bytes, *encoded, index.to_bytes(), pointer))
+
+
+def read_block_index(encoded: bytes) -> list[tuple[int, int]]:
+    """Return the byte offset and the amount of bits of every block."""
+    index_position = int.from_bytes(encoded[-r.INDEX_POINTER_SIZE:], 'big')
+    reader = BitReader(encoded[index_position:-r.INDEX_POINTER_SIZE])
+    block_count = reader.read_varint()
+    _, _, _, _, header_reader = r.separate_container(encoded)
+    offset = header_reader.position // r.BYTE_SIZE
+    index = []
+    for _ in range(block_count):
+        length = reader.read_varint()
+        index.append((offset, reader.read_varint()))
+        offset += length
+    return index
+
+
+def _decode_blocks(encoded: bytes, block_numbers: range, jobs: int|None) -> bytes:
+    """Decode some of the blocks of a block container, in parallel."""
+    flags, markov_order, counts, _, _ = r.separate_container(encoded)
+    if not flags & r.FLAG_BLOCKS:
+        raise ValueError('Data is not a block container.')
+    index = read_block_index(encoded)
+    index_position = int.from_bytes(encoded[-r.INDEX_POINTER_SIZE:], 'big')
+    ends = [offset for offset, _ in index[1:]] + [index_position]
+    jobs_arguments = []
+    for number in block_numbers:
+        offset, symbol_count = index[number]
+        jobs_arguments.append((encoded[offset:ends[number]], markov_order, symbol_count))
+    return b''.join(_parallel_map(_decode_block, jobs_arguments, jobs, markov_order, counts))
+
+
+def decoded_blocks(encoded: bytes, jobs: int|None = None) -> bytes:
+    """Decode every block of a block container, in parallel."""
+    return _decode_blocks(encoded, range(len(read_block_index(encoded))), jobs)
+
+
+def decoded_range(encoded: bytes, start: int, stop: int, jobs: int|None = None) -> bytes:
+    """
+    Decode bytes start to stop of the data in a block container.
+
+    Only the blocks that hold those bytes are decoded.
+    """
+    block_ends = np.cumsum([symbol_count // r.BYTE_SIZE for _, symbol_count in read_block_index(encoded)])
+    stop = min(stop, int(block_ends[-1])) if block_ends.size else 0
+    if start >= stop:
+        return b''
+    first = int(np.searchsorted(block_ends, start, side='right'))
+    last = int(np.searchsorted(block_ends, stop - 1, side='right'))
+    first_start = int(block_ends[first - 1]) if first else 0
+    decoded = _decode_blocks(encoded, range(first, last + 1), jobs)
+    return decoded[start-first_start:stop-first_start]
@@ -0,0 +1,174 @@
+from bisect import bisect_right
+
+import numpy as np
+
+from bitio import BitReader, BitWriter
+
+BYTE_ALPHABET = 256
+MAX_BYTE_ORDER = 3
+
+
+def byte_window_codes(data: np.ndarray, markov_order: int) -> np.ndarray:
+    """
+    Return the code of every byte together with its (order) previous bytes.
+
+    The code is the integer whose base 256 digits are the previous bytes
+    followed by the byte itself. Bytes before the start of the data are
+    taken as zeros, which is the context both encoder and decoder start
+    from, so there is one code per byte of data.
+    """
+    codes = data.astype(np.uint64)
+    for i in range(1, markov_order + 1):
+        previous = np.zeros(data.size, dtype=np.uint64)
+        previous[i:] = data[:data.size-i]
+        codes |= previous << np.uint64(8*i)
+    return codes
+
+
+def byte_occurrences(data: np.ndarray, markov_order: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return the codes of the windows of bytes that occurred and how many
+    times each of them did, in increasing order of code.
+
+    Only windows that occurred are kept, since there are 256^(order + 1)
+    possible ones.
+    """
+    codes, occurrences = np.unique(byte_window_codes(data, markov_order), return_counts=True)
+    return codes.astype(np.int64), occurrences.astype(np.int64)
+
+
+class ByteLimits:
+    """
+    Execute arithmetic coding with a byte as the symbol.
+
+    Works the same way as FastMBitLimits, with the same mappings and the
+    same ending of the encoded message, but each symbol is a whole byte
+    whose probability is given by the counts of the 256 possible bytes
+    after its (order) previous bytes. Every count starts at one, as in
+    _initialize_dict. The cumulative counts of each context are only
+    built for contexts that occurred; the others share the cumulative
+    counts of 256 ones. The decoded byte is found by binary search over
+    the cumulative counts of its context.
+    """
+    markov_order: int
+    cumulative_counts: dict[int, list[int]]
+    uniform_counts: list[int]
+    padding_number: int
+    word_length: int
+    lower: int
+    upper: int
+    context: int
+
+    def __init__(self, markov_order: int, codes: np.ndarray, occurrences: np.ndarray) -> None:
+        if markov_order > MAX_BYTE_ORDER:
+            raise ValueError(f'Byte contexts are limited to order {MAX_BYTE_ORDER}.')
+        self.markov_order = markov_order
+        self.uniform_counts = list(range(BYTE_ALPHABET + 1))
+        self.cumulative_counts = dict()
+        contexts = codes >> 8
+        boundaries = np.flatnonzero(np.diff(contexts)) + 1
+        for context_codes, context_occurrences in zip(np.split(codes, boundaries), np.split(occurrences, boundaries)):
+            if not context_codes.size:
+                continue
+            counts = np.ones(BYTE_ALPHABET, dtype=np.int64)
+            counts[context_codes & 0xFF] += context_occurrences
+            cumulative = np.concatenate(((0,), np.cumsum(counts)))
+            self.cumulative_counts[int(context_codes[0] >> 8)] = cumulative.tolist()
+        largest_total = max((cumulative[-1] for cumulative in self.cumulative_counts.values()), default=BYTE_ALPHABET)
+        self.word_length = int(2 + np.ceil(np.log2(largest_total)))
+        self.lower = 0
+        self.upper = 2**self.word_length - 1
+        self.context = 0
+        self.padding_number = 0
+
+    def encode(self, data: bytes, writer: BitWriter|None = None) -> BitWriter:
+        """Return encoded message."""
+        if writer is None:
+            writer = BitWriter()
+        write_bit = writer.write_bit
+        write_run = writer.write_run
+        cumulative_counts = self.cumulative_counts
+        uniform_counts = self.uniform_counts
+        context_mask = (1 << 8*self.markov_order) - 1
+        mask = (1 << self.word_length) - 1
+        half = 1 << (self.word_length - 1)
+        quarter = 1 << (self.word_length - 2)
+        three_quarters = half + quarter
+        lower, upper, context = self.lower, self.upper, self.context
+        e_3_counter = 0
+        for byte in data:
+            cumulative = cumulative_counts.get(context, uniform_counts)
+            total = cumulative[-1]
+            factor = upper - lower + 1
+            upper = lower + factor*cumulative[byte+1]//total - 1
+            lower = lower + factor*cumulative[byte]//total
+            context = ((context << 8) | byte) & context_mask
+            while True:
+                if upper < half:
+                    write_bit(0)
+                    lower = lower << 1
+                    upper = (upper << 1) | 1
+                    if e_3_counter:
+                        write_run(1, e_3_counter)
+                        e_3_counter = 0
+                elif lower >= half:
+                    write_bit(1)
+                    lower = (lower << 1) & mask
+                    upper = ((upper << 1) & mask) | 1
+                    if e_3_counter:
+                        write_run(0, e_3_counter)
+                        e_3_counter = 0
+                elif lower >= quarter and upper < three_quarters:
+                    lower = ((lower << 1) & mask) ^ half
+                    upper = (((upper << 1) & mask) | 1) ^ half
+                    e_3_counter += 1
+                else:
+                    break
+        self.lower, self.upper, self.context = lower, upper, context
+        left_most_bit = lower >> (self.word_length - 1)
+        write_bit(left_most_bit)
+        write_run(left_most_bit ^ 1, e_3_counter)
+        writer.write_int(lower & (half - 1), self.word_length - 1)
+        self.padding_number = writer.pad()
+        return writer
+
+    def decode(self, bits: BitReader, symbol_count: int) -> bytes:
+        """Return decoded message, stopping after symbol_count bytes."""
+        decoded_message = bytearray()
+        read_bit = bits.read_bit
+        cumulative_counts = self.cumulative_counts
+        uniform_counts = self.uniform_counts
+        context_mask = (1 << 8*self.markov_order) - 1
+        mask = (1 << self.word_length) - 1
+        half = 1 << (self.word_length - 1)
+        quarter = 1 << (self.word_length - 2)
+        three_quarters = half + quarter
+        tag = bits.read_int(self.word_length)
+        lower, upper, context = self.lower, self.upper, self.context
+        for _ in range(symbol_count):
+            cumulative = cumulative_counts.get(context, uniform_counts)
+            total = cumulative[-1]
+            factor = upper - lower + 1
+            value = ((tag - lower + 1)*total - 1)//factor
+            byte = bisect_right(cumulative, value) - 1
+            decoded_message.append(byte)
+            upper = lower + factor*cumulative[byte+1]//total - 1
+            lower = lower + factor*cumulative[byte]//total
+            context = ((context << 8) | byte) & context_mask
+            while True:
+                if upper < half:
+                    lower = lower << 1
+                    upper = (upper << 1) | 1
+                    tag = ((tag << 1) & mask) | read_bit()
+                elif lower >= half:
+                    lower = (lower << 1) & mask
+                    upper = ((upper << 1) & mask) | 1
+                    tag = ((tag << 1) & mask) | read_bit()
+                elif lower >= quarter and upper < three_quarters:
+                    lower = ((lower << 1) & mask) ^ half
+                    upper = (((upper << 1) & mask) | 1) ^ half
+                    tag = (((tag << 1) & mask) | read_bit()) ^ half
+                else:
+                    break
+        self.lower, self.upper, self.context = lower, upper, context
+        return bytes(decoded_message)
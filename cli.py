@@ -0,0 +1,319 @@
+import sys
+from argparse import ArgumentParser, Namespace
+from contextlib import nullcontext
+from typing import BinaryIO
+
+SUFFIX = '.acod'
+DECOMPRESSED_SUFFIX = '.out'
+STANDARD_STREAM = '-'
+COPY_CHUNK = 2**16
+HEADER_PREFIX_SIZE = 6
+
+
+class _ReadAheadInput:
+    """
+    Read from a binary input whose first bytes were read ahead, to tell
+    what it holds, counting the bytes read.
+
+    Works on pipes as well as files, since it never seeks.
+    """
+    file: BinaryIO
+    head: bytes
+    count: int
+
+    def __init__(self, file: BinaryIO, size: int) -> None:
+        self.file = file
+        self.head = file.read(size)
+        self.count = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            data = self.head + self.file.read()
+        elif size <= len(self.head):
+            data = self.head[:size]
+        else:
+            data = self.head + self.file.read(size - len(self.head))
+        self.head = self.head[len(data):]
+        self.count += len(data)
+        return data
+
+
+class _CountedOutput:
+    """Write to a binary output, counting the bytes written."""
+    file: BinaryIO
+    count: int
+
+    def __init__(self, file: BinaryIO) -> None:
+        self.file = file
+        self.count = 0
+
+    def write(self, data: bytes) -> int:
+        self.count += len(data)
+        return self.file.write(data)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+
+def _order(value: str) -> int|str:
+    """Parse an order, which is either a number or 'auto'."""
+    return value if value == 'auto' else int(value)
+
+
+def _read_input(path: str):
+    """
+    Return the bytes of an input.
+
+    Files are memory-mapped, so large inputs are paged in as they are
+    read instead of being copied up front. Empty files can't be mapped
+    and are read as they are.
+    """
+    if path == STANDARD_STREAM:
+        return sys.stdin.buffer.read()
+    import mmap
+    with open(path, 'rb') as file:
+        try:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return file.read()
+
+
+def _open_input(path: str):
+    """Open an input for reading, leaving the standard input open afterwards."""
+    return nullcontext(sys.stdin.buffer) if path == STANDARD_STREAM else open(path, 'rb')
+
+
+def _open_output(path: str, force: bool = False):
+    """
+    Open an output for writing, leaving the standard output open
+    afterwards.
+
+    An existing file is only overwritten if force is set.
+    """
+    if path == STANDARD_STREAM:
+        return nullcontext(sys.stdout.buffer)
+    try:
+        return open(path, 'wb' if force else 'xb')
+    except FileExistsError:
+        raise SystemExit(f'{path} already exists, use -f to overwrite it.') from None
+
+
+def _copy(source: BinaryIO, sink: BinaryIO) -> int:
+    """Copy a binary input into a sink, a chunk at a time, and return how many bytes were copied."""
+    copied_count = 0
+    while chunk := source.read(COPY_CHUNK):
+        sink.write(chunk)
+        copied_count += len(chunk)
+    return copied_count
+
+
+def compressed(data, markov_order: int|str, block_size: int|None = None, engine: str = 'arithmetic',
+               adaptive: bool = False, jobs: int|None = None, memory_budget: int|None = None,
+               precision: int|None = None) -> bytes:
+    """
+    Return the container of some data.
+
+    With a block size, the data is encoded in independent blocks in
+    parallel, otherwise it goes through encoded_data. A memory budget
+    keeps the adaptive model in a hashed table of that many bytes, and a
+    precision codes a static model in fixed precision.
+    """
+    if block_size is None:
+        import encode
+        encoded = encode.encoded_data(markov_order, data, adaptive=adaptive, engine=engine, jobs=jobs,
+                                      memory_budget=memory_budget, precision=precision)
+        return encoded[0] if isinstance(encoded, tuple) else encoded
+    if adaptive or engine != 'arithmetic' or memory_budget is not None or precision is not None:
+        raise ValueError('Blocks are only encoded by the arithmetic engine with a static model in full precision.')
+    import blocks
+    if markov_order == 'auto':
+        import numpy as np
+        import encode
+        bit_array = np.unpackbits(np.frombuffer(data, dtype=np.uint8)).view(np.int8)
+        markov_order, _ = encode.select_order(bit_array, jobs=jobs)
+    return blocks.encoded_blocks(data, markov_order, block_size, jobs=jobs)
+
+
+def compress_stream(source: BinaryIO, sink: BinaryIO, markov_order: int, adaptive: bool = False,
+                    memory_budget: int|None = None) -> int:
+    """
+    Encode a binary input into a sink a chunk at a time and return how
+    many bytes were read.
+
+    Adaptive models are encoded in one pass by AdaptiveStreamEncoder.
+    Static models go through encode_stream, which reads the input twice,
+    so an input that can't be sought, such as a pipe, is copied to a
+    temporary file first. Either way, memory use doesn't depend on the
+    size of the input.
+    """
+    import stream
+    if adaptive:
+        with stream.AdaptiveStreamEncoder(sink, markov_order, memory_budget=memory_budget) as encoder:
+            return _copy(source, encoder)
+    if memory_budget is not None:
+        raise ValueError('Only adaptive models are kept in a hashed table.')
+    if not source.seekable():
+        import tempfile
+        with tempfile.TemporaryFile() as file:
+            _copy(source, file)
+            file.seek(0)
+            return compress_stream(file, sink, markov_order)
+    start_position = source.tell()
+    stream.encode_stream(source, sink, markov_order, COPY_CHUNK)
+    return source.tell() - start_position
+
+
+def append(source: BinaryIO, path: str, markov_order: int, memory_budget: int|None = None) -> tuple[int, int]:
+    """
+    Encode a binary input at the end of the adaptive container in path
+    and return how many bytes were read and the size of the container.
+
+    The container is created, keeping the state of its model, if there
+    is none, and otherwise reopened with append_stream, so only the new
+    data is encoded. The input is encoded a chunk at a time.
+    """
+    import stream
+    try:
+        file = open(path, 'r+b')
+    except FileNotFoundError:
+        with open(path, 'wb') as file:
+            with stream.AdaptiveStreamEncoder(file, markov_order, memory_budget=memory_budget,
+                                              keep_state=True) as encoder:
+                read_count = _copy(source, encoder)
+            return read_count, file.tell()
+    with file:
+        with stream.append_stream(file) as encoder:
+            read_count = _copy(source, encoder)
+        return read_count, file.tell()
+
+
+def decompressed(encoded, jobs: int|None = None) -> bytes:
+    """Return the data of a container, decoding block containers in parallel."""
+    import numpy as np
+    import read as r
+    encoded = bytes(encoded)
+    flags = r.separate_container(encoded)[0]
+    if flags & r.FLAG_BLOCKS:
+        import blocks
+        return blocks.decoded_blocks(encoded, jobs)
+    import decode
+    return np.packbits(decode.decoded_bits(encoded).view(np.uint8)).tobytes()
+
+
+def _streamable(header: bytes) -> bool:
+    """
+    Return whether a container, given its first HEADER_PREFIX_SIZE
+    bytes, is a static container of the arithmetic engine, which
+    decode_stream decodes.
+    """
+    import read as r
+    if len(header) < HEADER_PREFIX_SIZE or header[:len(r.MAGIC)] != r.MAGIC:
+        return False
+    flags = header[HEADER_PREFIX_SIZE - 1]
+    return not flags & (r.FLAG_ADAPTIVE | r.FLAG_BLOCKS | r.FLAG_BYTES) and r.engine_name(flags) == 'arithmetic'
+
+
+def _in_memory(arguments: Namespace) -> bool:
+    """
+    Return whether compressing takes the whole input at once, which
+    blocks, the engines other than arithmetic, choosing the order and
+    fixed precision do.
+    """
+    return arguments.block_size is not None or arguments.engine != 'arithmetic' or arguments.order == 'auto' \
+        or arguments.precision is not None
+
+
+def _output_path(path: str, arguments: Namespace) -> str:
+    """Return where the result for an input goes."""
+    if path == STANDARD_STREAM or arguments.stdout:
+        return STANDARD_STREAM
+    if arguments.command == 'compress':
+        return path + SUFFIX
+    return path[:-len(SUFFIX)] if path.endswith(SUFFIX) else path + DECOMPRESSED_SUFFIX
+
+
+def _process(path: str, arguments: Namespace, jobs: int|None) -> tuple[str, int, int]:
+    """
+    Compress or decompress one input and return its path and sizes.
+
+    Inputs go through compress_stream and decode_stream a chunk at a
+    time, unless the options need the whole input, which is then
+    memory-mapped, or the container is one that decode_stream doesn't
+    decode.
+    """
+    if arguments.command == 'compress' and arguments.append:
+        if arguments.order == 'auto' or arguments.stdout:
+            raise SystemExit('Appending needs a fixed order and writes to the archive only.')
+        with _open_input(path) as source:
+            return path, *append(source, arguments.append, arguments.order, arguments.memory)
+    if arguments.command == 'compress' and _in_memory(arguments):
+        data = _read_input(path)
+        result = compressed(data, arguments.order, arguments.block_size, arguments.engine, arguments.adaptive, jobs,
+                            arguments.memory, arguments.precision)
+        with _open_output(_output_path(path, arguments), arguments.force) as sink:
+            sink.write(result)
+        return path, len(data), len(result)
+    with _open_input(path) as file, _open_output(_output_path(path, arguments), arguments.force) as file_sink:
+        sink = _CountedOutput(file_sink)
+        if arguments.command == 'compress':
+            read_count = compress_stream(file, sink, arguments.order, arguments.adaptive, arguments.memory)
+        else:
+            import stream
+            source = _ReadAheadInput(file, HEADER_PREFIX_SIZE)
+            if _streamable(source.head):
+                stream.decode_stream(source, sink)
+            else:
+                sink.write(decompressed(source.read(), jobs))
+            read_count = source.count
+        sink.flush()
+        return path, read_count, sink.count
+
+
+def _process_job(job: tuple[str, Namespace]) -> tuple[str, int, int]:
+    """Process an input in a worker, which has a single job of its own."""
+    path, arguments = job
+    return _process(path, arguments, 1)
+
+
+def _parser() -> ArgumentParser:
+    parser = ArgumentParser(prog='cli.py', description='Compress and decompress with arithmetic coding.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    compress = commands.add_parser('compress', help=f'compress inputs into {SUFFIX} files')
+    decompress = commands.add_parser('decompress', help=f'decompress {SUFFIX} files')
+    for command in (compress, decompress):
+        command.add_argument('files', nargs='*', default=[STANDARD_STREAM],
+                             help=f'inputs, or {STANDARD_STREAM} for the standard input (the default)')
+        command.add_argument('-c', '--stdout', action='store_true', help='write to the standard output')
+        command.add_argument('-f', '--force', action='store_true', help='overwrite existing output files')
+        command.add_argument('-j', '--jobs', type=int, help='processes to use, one per CPU by default')
+        command.add_argument('-v', '--verbose', action='store_true', help='report sizes on the standard error')
+    compress.add_argument('-o', '--order', type=_order, default=0, help='Markov order, or auto (default: 0)')
+    compress.add_argument('-b', '--block-size', type=int, help='encode in independent blocks of this many bytes')
+    compress.add_argument('-e', '--engine', default='arithmetic', choices=('arithmetic', 'range', 'rans'))
+    compress.add_argument('-a', '--adaptive', action='store_true', help='learn the model while coding')
+    compress.add_argument('-m', '--memory', type=int,
+                          help='keep the adaptive model in a hashed table of this many bytes, for orders up to 64')
+    compress.add_argument('-A', '--append', metavar='ARCHIVE',
+                          help='encode adaptively at the end of an archive, which is created if needed')
+    compress.add_argument('-p', '--precision', type=int, choices=(32, 64),
+                          help='code a static model with limits of this many bits, rescaling its counts')
+    return parser
+
+
+def main(argv: list[str]|None = None) -> None:
+    arguments = _parser().parse_args(argv)
+    if arguments.stdout and len(arguments.files) > 1:
+        raise SystemExit('Only a single input can be written to the standard output.')
+    if len(arguments.files) == 1 or getattr(arguments, 'append', None):
+        results = [_process(path, arguments, arguments.jobs) for path in arguments.files]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(arguments.jobs) as executor:
+            results = list(executor.map(_process_job, [(path, arguments) for path in arguments.files]))
+    if arguments.verbose:
+        for path, input_size, output_size in results:
+            print(f'{path}: {input_size} -> {output_size} bytes', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,8 @@ BYTE_SIZE = 8
 
 def bit_string_to_array(bit_string: str) -> np.ndarray:
     """Convert string of bits into an array."""
-    return np.array([int(bit) for bit in bit_string]).astype(np.int8)
+    characters = np.frombuffer(bit_string.encode('ascii'), dtype=np.uint8)
+    return (characters - ord('0')).astype(np.int8)
 
 
 def bit_array_to_int(bit_array: np.ndarray) -> int:
@@ -29,10 +30,7 @@ def bit_array_to_bytes(bit_array: np.ndarray) -> bytes:
     """
     if bit_array.size % BYTE_SIZE != 0:
         raise ValueError('Bit array size is not multiple of 8.')
-    byte_array = bit_array.reshape(int(bit_array.size/BYTE_SIZE), BYTE_SIZE)
-    byte_array = np.apply_along_axis(bit_array_to_int, axis=1, arr=byte_array)
-    byte_list = byte_array.tolist()
-    return bytes(byte_list)
+    return np.packbits(bit_array.astype(np.uint8)).tobytes()
 
 
 def bit_string_to_bytes(bit_string: str) -> bytes:
@@ -0,0 +1,38 @@
+from pathlib import Path
+
+import numpy as np
+
+import read as r
+from adaptive import AdaptiveMBitLimits, decode_segments
+from blocks import decoded_blocks
+from bytelimits import ByteLimits
+from converter import bit_array_to_bytes
+from encode import ENGINES
+from hotlimits import HotMBitLimits
+from hashedmodel import HashedAdaptiveMBitLimits
+
+
+def decoded_bits(encoded: bytes) -> np.ndarray:
+    """Return the bits encoded in a container."""
+    flags, markov_order, counts, symbol_count, reader = r.separate_container(encoded)
+    if flags & r.FLAG_ADAPTIVE and flags & r.FLAG_HASHED:
+        table_bits = reader.read_int(r.BYTE_SIZE)
+        return decode_segments(reader, HashedAdaptiveMBitLimits(markov_order, table_bits))
+    if flags & r.FLAG_ADAPTIVE:
+        return decode_segments(reader, AdaptiveMBitLimits(markov_order))
+    if flags & r.FLAG_BYTES:
+        decoded = ByteLimits(markov_order, *counts).decode(reader, symbol_count)
+        return np.unpackbits(np.frombuffer(decoded, dtype=np.uint8)).view(np.int8)
+    if flags & r.FLAG_BLOCKS:
+        return np.unpackbits(np.frombuffer(decoded_blocks(encoded), dtype=np.uint8)).view(np.int8)
+    if flags & r.FLAG_FIXED:
+        precision = reader.read_int(r.BYTE_SIZE)
+        return HotMBitLimits(markov_order, counts, precision=precision).decode(reader, symbol_count)
+    engine = ENGINES[r.engine_name(flags)]
+    return engine(markov_order, counts).decode(reader, symbol_count)
+
+
+def decoded_bytes(encoded_path: Path) -> bytes:
+    with open(encoded_path, 'rb') as file:
+        encoded = file.read()
+    return bit_array_to_bytes(decoded_bits(encoded))
@@ -1,11 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import numpy as np
+
 import read as r
-from mbitlimits import MBitLimits
-from converter import bit_string_to_bytes
-from occurrences import occurrence_dict_from_sequence
+from adaptive import AdaptiveMBitLimits
+from bitio import BitWriter
+from bytelimits import ByteLimits, byte_occurrences
+from fastlimits import PRECISIONS
+from hashedmodel import HashedAdaptiveMBitLimits, table_bits_for_budget
+from hotlimits import HotMBitLimits
+from modelcache import ModelCache
+from occurrences import ideal_code_length, multi_order_counts, occurrence_counts, rescaled_counts
+from rangecoder import RangeMBitLimits
+from rans import RansMBitLimits
 
 ORDER = 0
+AUTO_ORDER = 'auto'
+AUTO_ORDERS = tuple(range(17))
+ENGINES = {'arithmetic': HotMBitLimits, 'range': RangeMBitLimits, 'rans': RansMBitLimits}
 ENCODED_PATH = Path(r'encoded_message.txt')
 
 
@@ -18,10 +31,191 @@ def _header_string(padding_number: int, markov_order: int, occurrence_dict: dict
         string_list.append(f'{occurrence_count:032b}')
     return ''.join(string_list)
 
-def encoded_bytes(markov_order: int, data_path: Path) -> bytes:
-    bit_array = r.read_bits(data_path)
-    occurrence_dict = occurrence_dict_from_sequence(bit_array, markov_order)
-    limits = MBitLimits(markov_order, occurrence_dict)
-    encoded_message = limits.encode(bit_array)
-    header = _header_string(limits.padding_number, markov_order, occurrence_dict)
-    return bit_string_to_bytes(''.join((header, encoded_message)))
+
+def _write_header(writer: BitWriter, padding_number: int, markov_order: int, counts: np.ndarray) -> None:
+    """Write header for encoded message, same as _header_string."""
+    writer.write_int(padding_number, r.PADDING_CHUNK)
+    writer.write_int(markov_order, r.ORDER_CHUNK)
+    for count in counts.tolist():
+        writer.write_int(count, r.OCCURRENCE_CHUNK)
+
+
+def write_count_pairs(writer: BitWriter, codes: np.ndarray, occurrences: np.ndarray) -> None:
+    """Write windows that occurred, in increasing order, as read_count_pairs reads them."""
+    gaps = np.diff(codes, prepend=-1) - 1
+    writer.write_varint(codes.size)
+    for gap, occurrence in zip(gaps.tolist(), occurrences.tolist()):
+        writer.write_varint(gap)
+        writer.write_varint(occurrence)
+
+
+def write_count_table(writer: BitWriter, counts: np.ndarray) -> None:
+    """Write the occurrence counts of a container, as read_count_table reads them."""
+    codes = np.flatnonzero(counts > 1)
+    write_count_pairs(writer, codes, counts[codes] - 1)
+
+
+def write_container_header(writer: BitWriter, markov_order: int, flags: int = 0, symbol_count: int = 0,
+                           counts: np.ndarray|tuple[np.ndarray, np.ndarray]|None = None) -> None:
+    """
+    Write the header of a container.
+
+    The header is the magic number, the version, the flags and the order,
+    each in a byte. Unless the container is adaptive, they are followed
+    by the amount of bits encoded, as a varint, and the count table.
+    Block containers leave the amount of bits to the block index, and
+    the count table to each block if the blocks have their own models.
+    Byte containers count bytes, and their count table is given as the
+    pairs of codes and occurrences of byte_occurrences.
+    """
+    writer.write_bytes(r.MAGIC)
+    writer.write_int(r.VERSION, r.BYTE_SIZE)
+    writer.write_int(flags, r.BYTE_SIZE)
+    writer.write_int(markov_order, r.BYTE_SIZE)
+    if flags & r.FLAG_ADAPTIVE:
+        return
+    if not flags & r.FLAG_BLOCKS:
+        writer.write_varint(symbol_count)
+    if flags & r.FLAG_BYTES:
+        write_count_pairs(writer, *counts)
+    elif not flags & r.FLAG_BLOCK_MODELS:
+        write_count_table(writer, counts)
+
+
+def engine_flags(engine: str) -> int:
+    """Return the container flags that name an engine."""
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown engine {engine!r}, expected one of {", ".join(ENGINES)}.')
+    return r.ENGINE_NAMES.index(engine) << r.ENGINE_SHIFT
+
+
+def _estimated_size(arguments: tuple[int, np.ndarray, int]) -> int:
+    """
+    Return the estimated byte length of a static container.
+
+    The header is written to know its exact length, and the encoded
+    message takes its ideal code length, plus the word length the
+    encoder writes to end it.
+    """
+    markov_order, counts, symbol_count = arguments
+    header = BitWriter()
+    write_container_header(header, markov_order, 0, symbol_count, counts)
+    word_length = int(2 + np.ceil(np.log2(counts.sum())))
+    message_bits = int(np.ceil(ideal_code_length(counts, markov_order))) + word_length
+    return len(header.to_bytes()) + -(-message_bits // r.BYTE_SIZE)
+
+
+def order_estimates(bit_array: np.ndarray, markov_orders: tuple[int, ...] = AUTO_ORDERS, jobs: int|None = None,
+                    cache: ModelCache|None = None) -> dict[int, int]:
+    """
+    Return the estimated byte length of the static container of every
+    order, without encoding.
+
+    The counts of every order come from a single count at the highest
+    one, or from the cache, and the orders are estimated in parallel
+    threads, since the estimates are NumPy reductions.
+    """
+    if cache is None:
+        models = multi_order_counts(bit_array, markov_orders)
+    else:
+        models = cache.counts(np.packbits(bit_array.view(np.uint8)).tobytes(), markov_orders)
+    arguments = [(markov_order, counts, bit_array.size) for markov_order, counts in models.items()]
+    with ThreadPoolExecutor(jobs) as executor:
+        return dict(zip(models, executor.map(_estimated_size, arguments)))
+
+
+def select_order(bit_array: np.ndarray, markov_orders: tuple[int, ...] = AUTO_ORDERS, jobs: int|None = None,
+                 cache: ModelCache|None = None) -> tuple[int, dict[int, int]]:
+    """Return the order with the smallest estimated container, and the estimates of every order."""
+    estimates = order_estimates(bit_array, markov_orders, jobs, cache)
+    return min(estimates, key=estimates.get), estimates
+
+
+def encoded_bytes(markov_order: int|str, data_path: Path, adaptive: bool = False, byte_symbols: bool = False,
+                  engine: str = 'arithmetic', cache: ModelCache|None = None, jobs: int|None = None,
+                  memory_budget: int|None = None, precision: int|None = None) -> bytes|tuple[bytes, dict[int, int]]:
+    """Encode a file into a container, as encoded_data does."""
+    data = np.fromfile(data_path, dtype=np.uint8)
+    return encoded_data(markov_order, data, adaptive, byte_symbols, engine, cache, jobs, memory_budget, precision)
+
+
+def encoded_data(markov_order: int|str, data: bytes|np.ndarray, adaptive: bool = False, byte_symbols: bool = False,
+                 engine: str = 'arithmetic', cache: ModelCache|None = None, jobs: int|None = None,
+                 memory_budget: int|None = None, precision: int|None = None) -> bytes|tuple[bytes, dict[int, int]]:
+    """
+    Encode data into a container.
+
+    Data can be anything that exposes its bytes, such as a memory map.
+    If the order is 'auto', the order with the smallest estimated
+    container is chosen with select_order, and the estimates of every
+    order are returned along with the container. An adaptive container
+    with a memory budget keeps its counts in the hashed table of
+    HashedAdaptiveMBitLimits, which allows orders of up to 64 bits, and
+    the bits of the table follow the header in a byte. A precision codes
+    a static model in fixed precision, and follows the header in a byte
+    too.
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    if precision is not None and (adaptive or byte_symbols or engine != 'arithmetic'):
+        raise ValueError('Fixed precision is only used by the arithmetic engine with a static bit model.')
+    if markov_order == AUTO_ORDER:
+        if adaptive or byte_symbols:
+            raise ValueError('Orders are only chosen automatically for static bit models.')
+        bit_array = np.unpackbits(data).view(np.int8)
+        markov_order, estimates = select_order(bit_array, jobs=jobs, cache=cache)
+        return _encoded_static(bit_array, markov_order, engine, cache, precision), estimates
+    flags = engine_flags(engine)
+    if flags and (adaptive or byte_symbols):
+        raise ValueError(f'The {engine} engine only codes bits with a static model.')
+    if byte_symbols:
+        if adaptive:
+            raise ValueError('Byte symbols are only coded with a static model.')
+        codes, occurrences = byte_occurrences(data, markov_order)
+        writer = BitWriter()
+        write_container_header(writer, markov_order, r.FLAG_BYTES, data.size, (codes, occurrences))
+        ByteLimits(markov_order, codes, occurrences).encode(data.tobytes(), writer)
+        return writer.to_bytes()
+    bit_array = np.unpackbits(data).view(np.int8)
+    if memory_budget is not None and not adaptive:
+        raise ValueError('Only adaptive models are kept in a hashed table.')
+    if adaptive:
+        writer = BitWriter()
+        if memory_budget is None:
+            write_container_header(writer, markov_order, r.FLAG_ADAPTIVE)
+            limits = AdaptiveMBitLimits(markov_order)
+        else:
+            table_bits = table_bits_for_budget(memory_budget)
+            write_container_header(writer, markov_order, r.FLAG_ADAPTIVE | r.FLAG_HASHED)
+            writer.write_int(table_bits, r.BYTE_SIZE)
+            limits = HashedAdaptiveMBitLimits(markov_order, table_bits)
+        writer.write_varint(bit_array.size)
+        limits.encode(bit_array, writer)
+        writer.write_varint(0)
+        return writer.to_bytes()
+    return _encoded_static(bit_array, markov_order, engine, cache, precision)
+
+
+def _encoded_static(bit_array: np.ndarray, markov_order: int, engine: str, cache: ModelCache|None,
+                    precision: int|None = None) -> bytes:
+    """
+    Encode bits into a static container.
+
+    In fixed precision the counts are rescaled before they are written,
+    so the decoder reads the ones the encoder used.
+    """
+    if cache is None:
+        counts = occurrence_counts(bit_array, markov_order)
+    else:
+        counts = cache.counts(np.packbits(bit_array.view(np.uint8)).tobytes(), (markov_order,))[markov_order]
+    writer = BitWriter()
+    if precision is None:
+        write_container_header(writer, markov_order, engine_flags(engine), bit_array.size, counts)
+        ENGINES[engine](markov_order, counts).encode(bit_array, writer)
+        return writer.to_bytes()
+    if precision not in PRECISIONS:
+        raise ValueError(f'Precision has to be one of {PRECISIONS}, not {precision}.')
+    counts = rescaled_counts(counts, markov_order, precision - 2)
+    write_container_header(writer, markov_order, r.FLAG_FIXED, bit_array.size, counts)
+    writer.write_int(precision, r.BYTE_SIZE)
+    HotMBitLimits(markov_order, counts, precision=precision).encode(bit_array, writer)
+    return writer.to_bytes()
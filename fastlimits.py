@@ -0,0 +1,396 @@
+import numpy as np
+
+from bitio import BitReader, BitWriter
+from occurrences import counts_from_occurrence_dict, cumulative_array, rescaled_counts, sequence_length
+from tracing import CodingCounters, Tracer
+
+PRECISIONS = (32, 64)
+
+
+class FastMBitLimits:
+    """
+    Execute the same arithmetic coding as MBitLimits, but faster.
+
+    The context of (order) previous bits is kept as an integer that is
+    rolled with every new bit, and the counts are read from cumulative
+    count lists indexed by that integer, so no strings are built and no
+    dictionary is searched per symbol. The limits are kept in local
+    variables inside the coding loops and the mappings are decided by
+    comparing them with the half and quarter of the range. The encoded
+    and decoded messages are bit-identical to the ones of MBitLimits.
+
+    Coding can be instrumented by giving a tracer, which is called with
+    every symbol and mapping, or counters, which add up the mappings and
+    time the encoding and decoding. The instrumented loops are separate
+    from the plain ones and are chosen once per call, so a coder without
+    a tracer or counters does no extra work per symbol.
+
+    By default the word length grows with the total count, so it grows
+    with the input. With a precision of 32 or 64 bits, the word length
+    is the precision instead, and the counts of every context are first
+    rescaled with rescaled_counts so their total is at most a quarter
+    of the range, which is all the coder needs. The limits and the tag
+    then always fit in (precision) bits, and with 32 bits every product
+    of a range and a count fits in a signed 64 bit integer, so the cost
+    of every symbol stays the same for any input size.
+    """
+    markov_order: int
+    zero_counts: list[int]
+    total_counts: list[int]
+    symbol_count: int
+    e_3_mapping_counter: int
+    padding_number: int
+    word_length: int
+    tag: int
+    lower: int
+    upper: int
+    context: int
+    tracer: Tracer|None
+    counters: CodingCounters|None
+    precision: int|None
+
+    def __init__(self, markov_order: int, occurrences: dict[str, int]|np.ndarray, tracer: Tracer|None = None,
+                 counters: CodingCounters|None = None, precision: int|None = None) -> None:
+        if precision is None:
+            cumulative = cumulative_array(occurrences, markov_order)
+            self.word_length = int(2 + np.ceil(np.log2(cumulative[:, 2].sum())))
+        elif precision in PRECISIONS:
+            counts = occurrences
+            if isinstance(counts, dict):
+                counts = counts_from_occurrence_dict(counts, markov_order)
+            cumulative = cumulative_array(rescaled_counts(counts, markov_order, precision - 2), markov_order)
+            self.word_length = precision
+        else:
+            raise ValueError(f'Precision has to be one of {PRECISIONS}, not {precision}.')
+        self.precision = precision
+        self.markov_order = markov_order
+        self.zero_counts = cumulative[:, 1].tolist()
+        self.total_counts = cumulative[:, 2].tolist()
+        self.symbol_count = sequence_length(occurrences, markov_order)
+        self.tag = 0
+        self.lower = 0
+        self.upper = 2**self.word_length - 1
+        self.context = 0
+        self.e_3_mapping_counter = 0
+        self.padding_number = 0
+        if tracer is not None and counters is None:
+            counters = CodingCounters()
+        self.tracer = tracer
+        self.counters = counters
+
+    def __repr__(self) -> str:
+        """
+        Define representation for FastMBitLimits when using print().
+
+        Useful mostly for debugging purposes. Doesn't affect how the
+        algorithm works.
+        """
+        lower_string = f'lower = ({self.lower:0{self.word_length}b})₂'
+        upper_string = f'upper = ({self.upper:0{self.word_length}b})₂'
+        context = f'context = {self.context}'
+        return ', '.join((lower_string, upper_string, context))
+
+    def restart(self) -> None:
+        """
+        Restart the limits for a new encoded message.
+
+        The context is kept, so the new message carries on from the
+        bits of the previous one.
+        """
+        self.tag = 0
+        self.lower = 0
+        self.upper = 2**self.word_length - 1
+        self.e_3_mapping_counter = 0
+
+    def encode(self, bit_array: np.ndarray, writer: BitWriter|None = None) -> BitWriter:
+        """Return encoded message."""
+        if writer is None:
+            writer = BitWriter()
+        if self.counters is None:
+            self.encode_bits(bit_array, writer)
+            self.finish(writer)
+            return writer
+        start_length = len(writer)
+        with self.counters.phase('encode'):
+            self.encode_bits(bit_array, writer)
+            self.finish(writer)
+        self.counters.symbols += bit_array.size
+        self.counters.coded_bits += len(writer) - start_length
+        return writer
+
+    def encode_bits(self, bit_array: np.ndarray, writer: BitWriter) -> None:
+        """
+        Encode bits without ending the encoded message.
+
+        The limits, the context and the E_3 mapping counter are kept
+        between calls, so a message can be encoded a chunk at a time.
+        """
+        if self.counters is not None:
+            self._traced_encode_bits(bit_array, writer)
+            return
+        write_bit = writer.write_bit
+        write_run = writer.write_run
+        zero_counts = self.zero_counts
+        total_counts = self.total_counts
+        context_mask = (1 << self.markov_order) - 1
+        mask = (1 << self.word_length) - 1
+        half = 1 << (self.word_length - 1)
+        quarter = 1 << (self.word_length - 2)
+        three_quarters = half + quarter
+        lower, upper, context = self.lower, self.upper, self.context
+        e_3_counter = self.e_3_mapping_counter
+        for bit in bit_array.tolist():
+            factor = upper - lower + 1
+            split = factor*zero_counts[context]//total_counts[context]
+            if bit:
+                lower += split
+            else:
+                upper = lower + split - 1
+            context = ((context << 1) | bit) & context_mask
+            while True:
+                if upper < half:
+                    write_bit(0)
+                    lower = lower << 1
+                    upper = (upper << 1) | 1
+                    if e_3_counter:
+                        write_run(1, e_3_counter)
+                        e_3_counter = 0
+                elif lower >= half:
+                    write_bit(1)
+                    lower = (lower << 1) & mask
+                    upper = ((upper << 1) & mask) | 1
+                    if e_3_counter:
+                        write_run(0, e_3_counter)
+                        e_3_counter = 0
+                elif lower >= quarter and upper < three_quarters:
+                    lower = ((lower << 1) & mask) ^ half
+                    upper = (((upper << 1) & mask) | 1) ^ half
+                    e_3_counter += 1
+                else:
+                    break
+        self.lower, self.upper, self.context = lower, upper, context
+        self.e_3_mapping_counter = e_3_counter
+
+    def finish(self, writer: BitWriter) -> None:
+        """
+        End the encoded message.
+
+        The lower limit is written, with the bits owed to the pending
+        E_3 mappings after its left most bit, and the message is padded
+        with zeros to a whole byte.
+        """
+        left_most_bit = self.lower >> (self.word_length - 1)
+        writer.write_bit(left_most_bit)
+        writer.write_run(left_most_bit ^ 1, self.e_3_mapping_counter)
+        writer.write_int(self.lower % 2**(self.word_length - 1), self.word_length - 1)
+        self.e_3_mapping_counter = 0
+        self.padding_number = writer.pad()
+
+    def decode(self, bits: np.ndarray|BitReader, symbol_count: int|None = None) -> np.ndarray:
+        """
+        Return decoded message.
+
+        Decoding stops after symbol_count bits. If it is not given, it
+        is inferred from the occurrence dictionary.
+        """
+        if isinstance(bits, np.ndarray):
+            bits = BitReader.from_array(bits)
+        if symbol_count is None:
+            symbol_count = self.symbol_count
+        if self.counters is None:
+            return self.decode_bits(bits, symbol_count)
+        start_position = bits.position
+        with self.counters.phase('decode'):
+            decoded_message = self.decode_bits(bits, symbol_count)
+        self.counters.symbols += symbol_count
+        self.counters.coded_bits += bits.position - start_position
+        return decoded_message
+
+    def decode_bits(self, bits: BitReader, symbol_count: int, resume: bool = False) -> np.ndarray:
+        """
+        Decode symbol_count bits, starting from the current limits and
+        context.
+
+        The tag is read from the start of bits, unless decoding resumes
+        where a previous call left it, in which case the current tag is
+        kept and bits carries on right after the bits it already holds.
+        """
+        if self.counters is not None:
+            return self._traced_decode_bits(bits, symbol_count, resume)
+        decoded_message = BitWriter()
+        write_bit = decoded_message.write_bit
+        read_bit = bits.read_bit
+        zero_counts = self.zero_counts
+        total_counts = self.total_counts
+        context_mask = (1 << self.markov_order) - 1
+        mask = (1 << self.word_length) - 1
+        half = 1 << (self.word_length - 1)
+        quarter = 1 << (self.word_length - 2)
+        three_quarters = half + quarter
+        tag = self.tag if resume else bits.read_int(self.word_length)
+        lower, upper, context = self.lower, self.upper, self.context
+        for _ in range(symbol_count):
+            factor = upper - lower + 1
+            zero_count = zero_counts[context]
+            total = total_counts[context]
+            split = factor*zero_count//total
+            if ((tag - lower + 1)*total - 1)//factor < zero_count:
+                bit = 0
+                upper = lower + split - 1
+            else:
+                bit = 1
+                lower += split
+            write_bit(bit)
+            context = ((context << 1) | bit) & context_mask
+            while True:
+                if upper < half:
+                    lower = lower << 1
+                    upper = (upper << 1) | 1
+                    tag = ((tag << 1) & mask) | read_bit()
+                elif lower >= half:
+                    lower = (lower << 1) & mask
+                    upper = ((upper << 1) & mask) | 1
+                    tag = ((tag << 1) & mask) | read_bit()
+                elif lower >= quarter and upper < three_quarters:
+                    lower = ((lower << 1) & mask) ^ half
+                    upper = (((upper << 1) & mask) | 1) ^ half
+                    tag = (((tag << 1) & mask) | read_bit()) ^ half
+                else:
+                    break
+        self.tag, self.lower, self.upper, self.context = tag, lower, upper, context
+        return decoded_message.to_array()
+
+    def _traced_encode_bits(self, bit_array: np.ndarray, writer: BitWriter) -> None:
+        """Encode bits as encode_bits does, counting mappings and calling the tracer."""
+        write_bit = writer.write_bit
+        write_run = writer.write_run
+        zero_counts = self.zero_counts
+        total_counts = self.total_counts
+        tracer = self.tracer
+        context_mask = (1 << self.markov_order) - 1
+        mask = (1 << self.word_length) - 1
+        half = 1 << (self.word_length - 1)
+        quarter = 1 << (self.word_length - 2)
+        three_quarters = half + quarter
+        lower, upper, context = self.lower, self.upper, self.context
+        e_3_counter = self.e_3_mapping_counter
+        e_1 = e_2 = e_3 = 0
+        max_e_3_run = self.counters.max_e_3_run
+        for bit in bit_array.tolist():
+            factor = upper - lower + 1
+            split = factor*zero_counts[context]//total_counts[context]
+            if bit:
+                lower += split
+            else:
+                upper = lower + split - 1
+            context = ((context << 1) | bit) & context_mask
+            if tracer is not None:
+                tracer('symbol', lower, upper, context)
+            while True:
+                if upper < half:
+                    write_bit(0)
+                    lower = lower << 1
+                    upper = (upper << 1) | 1
+                    e_1 += 1
+                    if e_3_counter:
+                        write_run(1, e_3_counter)
+                        max_e_3_run = max(max_e_3_run, e_3_counter)
+                        e_3_counter = 0
+                    if tracer is not None:
+                        tracer('e_1', lower, upper, context)
+                elif lower >= half:
+                    write_bit(1)
+                    lower = (lower << 1) & mask
+                    upper = ((upper << 1) & mask) | 1
+                    e_2 += 1
+                    if e_3_counter:
+                        write_run(0, e_3_counter)
+                        max_e_3_run = max(max_e_3_run, e_3_counter)
+                        e_3_counter = 0
+                    if tracer is not None:
+                        tracer('e_2', lower, upper, context)
+                elif lower >= quarter and upper < three_quarters:
+                    lower = ((lower << 1) & mask) ^ half
+                    upper = (((upper << 1) & mask) | 1) ^ half
+                    e_3 += 1
+                    e_3_counter += 1
+                    if tracer is not None:
+                        tracer('e_3', lower, upper, context)
+                else:
+                    break
+        self.lower, self.upper, self.context = lower, upper, context
+        self.e_3_mapping_counter = e_3_counter
+        counters = self.counters
+        counters.e_1 += e_1
+        counters.e_2 += e_2
+        counters.e_3 += e_3
+        counters.max_e_3_run = max(max_e_3_run, e_3_counter)
+
+    def _traced_decode_bits(self, bits: BitReader, symbol_count: int, resume: bool = False) -> np.ndarray:
+        """Decode bits as decode_bits does, counting mappings and calling the tracer."""
+        decoded_message = BitWriter()
+        write_bit = decoded_message.write_bit
+        read_bit = bits.read_bit
+        zero_counts = self.zero_counts
+        total_counts = self.total_counts
+        tracer = self.tracer
+        context_mask = (1 << self.markov_order) - 1
+        mask = (1 << self.word_length) - 1
+        half = 1 << (self.word_length - 1)
+        quarter = 1 << (self.word_length - 2)
+        three_quarters = half + quarter
+        tag = self.tag if resume else bits.read_int(self.word_length)
+        lower, upper, context = self.lower, self.upper, self.context
+        e_1 = e_2 = e_3 = e_3_run = 0
+        max_e_3_run = self.counters.max_e_3_run
+        for _ in range(symbol_count):
+            factor = upper - lower + 1
+            zero_count = zero_counts[context]
+            total = total_counts[context]
+            split = factor*zero_count//total
+            if ((tag - lower + 1)*total - 1)//factor < zero_count:
+                bit = 0
+                upper = lower + split - 1
+            else:
+                bit = 1
+                lower += split
+            write_bit(bit)
+            context = ((context << 1) | bit) & context_mask
+            if tracer is not None:
+                tracer('symbol', lower, upper, context)
+            while True:
+                if upper < half:
+                    lower = lower << 1
+                    upper = (upper << 1) | 1
+                    tag = ((tag << 1) & mask) | read_bit()
+                    e_1 += 1
+                    max_e_3_run = max(max_e_3_run, e_3_run)
+                    e_3_run = 0
+                    if tracer is not None:
+                        tracer('e_1', lower, upper, context)
+                elif lower >= half:
+                    lower = (lower << 1) & mask
+                    upper = ((upper << 1) & mask) | 1
+                    tag = ((tag << 1) & mask) | read_bit()
+                    e_2 += 1
+                    max_e_3_run = max(max_e_3_run, e_3_run)
+                    e_3_run = 0
+                    if tracer is not None:
+                        tracer('e_2', lower, upper, context)
+                elif lower >= quarter and upper < three_quarters:
+                    lower = ((lower << 1) & mask) ^ half
+                    upper = (((upper << 1) & mask) | 1) ^ half
+                    tag = (((tag << 1) & mask) | read_bit()) ^ half
+                    e_3 += 1
+                    e_3_run += 1
+                    if tracer is not None:
+                        tracer('e_3', lower, upper, context)
+                else:
+                    break
+        self.tag, self.lower, self.upper, self.context = tag, lower, upper, context
+        counters = self.counters
+        counters.e_1 += e_1
+        counters.e_2 += e_2
+        counters.e_3 += e_3
+        counters.max_e_3_run = max(max_e_3_run, e_3_run)
+        return decoded_message.to_array()
@@ -0,0 +1,240 @@
+from array import array
+
+import numpy as np
+
+from adaptive import CONTEXT_SIZE, RESCALE_LIMIT, AdaptiveMBitLimits
+from bitio import BitReader, BitWriter
+from tracing import CodingCounters
+
+MEMORY_BUDGET = 2**24
+SLOT_SIZE = 9
+MAX_CONTEXT_BITS = 64
+MAX_TABLE_BITS = 32
+HASH_BITS = 64
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+CHECK_BITS = 8
+
+
+def table_bits_for_budget(memory_budget: int) -> int:
+    """Return the bits of the largest table of slots that fits in a memory budget."""
+    slot_count = memory_budget // SLOT_SIZE
+    if slot_count < 2:
+        raise ValueError(f'A memory budget of {memory_budget} bytes does not fit two slots.')
+    return min(slot_count.bit_length() - 1, MAX_TABLE_BITS)
+
+
+class HashedAdaptiveMBitLimits(AdaptiveMBitLimits):
+    """
+    Execute adaptive arithmetic coding with long contexts kept in a
+    hashed table of fixed size.
+
+    Instead of a count for every one of the 2^(order + 1) windows, the
+    counts are kept in a table of 2^(table bits) slots, each holding the
+    count of zeros and the total count of a context and a check byte,
+    SLOT_SIZE bytes in all, so the memory budget fixes the size of the
+    table whatever the order. A context is multiplied by HASH_MULTIPLIER
+    modulo 2^64, the top (table bits) bits of the product pick a slot and
+    the next CHECK_BITS bits are the check of the context.
+
+    A context may use its slot or the one next to it, whose index only
+    differs in the last bit. If neither holds its check, the slot of the
+    two with the smaller total count is evicted, since it is the one
+    that has learned the least, and it starts over with a count of one
+    for each bit. Contexts whose hash collides in the slot and the
+    check share their counts. Encoder and decoder look up and evict
+    slots in the same way, so they keep the same table.
+    """
+    table_bits: int
+    checks: bytearray
+
+    def __init__(self, markov_order: int, table_bits: int|None = None, memory_budget: int = MEMORY_BUDGET,
+                 rescale_limit: int = RESCALE_LIMIT, counters: CodingCounters|None = None) -> None:
+        if not 0 <= markov_order <= MAX_CONTEXT_BITS:
+            raise ValueError(f'Hashed contexts have between 0 and {MAX_CONTEXT_BITS} bits, not {markov_order}.')
+        if table_bits is None:
+            table_bits = table_bits_for_budget(memory_budget)
+        if not 1 <= table_bits <= MAX_TABLE_BITS:
+            raise ValueError(f'Hashed tables have between 1 and {MAX_TABLE_BITS} bits, not {table_bits}.')
+        super().__init__(0, rescale_limit, counters)
+        self.markov_order = markov_order
+        self.table_bits = table_bits
+        self.zero_counts = array('I', [1])*2**table_bits
+        self.total_counts = array('I', [2])*2**table_bits
+        self.checks = bytearray(2**table_bits)
+
+    @property
+    def counts(self) -> np.ndarray:
+        """Return the current counts of every slot, as pairs of zeros and ones."""
+        counts = np.empty(2**(self.table_bits + 1), dtype=np.int64)
+        counts[0::2] = self.zero_counts
+        counts[1::2] = np.subtract(self.total_counts, self.zero_counts)
+        return counts
+
+    def state(self) -> bytes:
+        """Return the state of the model, as AdaptiveMBitLimits does, followed by the checks."""
+        return super().state() + bytes(self.checks)
+
+    def restore_state(self, state: bytes) -> None:
+        """Resume the model from a state returned by state."""
+        slot_count = len(self.checks)
+        if len(state) != CONTEXT_SIZE + SLOT_SIZE*slot_count:
+            raise ValueError('The state is not one of a model with a table of this size.')
+        counts = np.frombuffer(state, dtype='>u4', count=2*slot_count, offset=CONTEXT_SIZE).astype(np.uint32)
+        self.context = int.from_bytes(state[:CONTEXT_SIZE], 'big')
+        self.zero_counts = array('I', counts[:slot_count].tobytes())
+        self.total_counts = array('I', counts[slot_count:].tobytes())
+        self.checks = bytearray(state[-slot_count:])
+
+    def encode_bits(self, bit_array: np.ndarray, writer: BitWriter) -> None:
+        """
+        Encode bits without ending the encoded message.
+
+        The table, the limits, the context and the E_3 mapping counter
+        are kept between calls.
+        """
+        write_bit = writer.write_bit
+        write_run = writer.write_run
+        zero_counts = self.zero_counts
+        total_counts = self.total_counts
+        checks = self.checks
+        rescale_limit = self.rescale_limit
+        context_mask = (1 << self.markov_order) - 1
+        hash_mask = (1 << HASH_BITS) - 1
+        slot_shift = HASH_BITS - self.table_bits
+        check_mask = (1 << CHECK_BITS) - 1
+        mask = (1 << self.word_length) - 1
+        half = 1 << (self.word_length - 1)
+        quarter = 1 << (self.word_length - 2)
+        three_quarters = half + quarter
+        lower, upper, context = self.lower, self.upper, self.context
+        e_3_counter = self.e_3_mapping_counter
+        for bit in bit_array.tolist():
+            hashed = (context*HASH_MULTIPLIER) & hash_mask
+            slot = hashed >> slot_shift
+            check = (hashed >> (slot_shift - CHECK_BITS)) & check_mask
+            if checks[slot] != check:
+                neighbour = slot ^ 1
+                if checks[neighbour] == check:
+                    slot = neighbour
+                else:
+                    if total_counts[neighbour] < total_counts[slot]:
+                        slot = neighbour
+                    checks[slot] = check
+                    zero_counts[slot] = 1
+                    total_counts[slot] = 2
+            zero_count = zero_counts[slot]
+            total = total_counts[slot]
+            factor = upper - lower + 1
+            split = factor*zero_count//total
+            if bit:
+                lower += split
+            else:
+                upper = lower + split - 1
+                zero_count += 1
+            total += 1
+            if total > rescale_limit:
+                one_count = total - zero_count
+                zero_count = (zero_count + 1) >> 1
+                total = zero_count + ((one_count + 1) >> 1)
+            zero_counts[slot] = zero_count
+            total_counts[slot] = total
+            context = ((context << 1) | bit) & context_mask
+            while True:
+                if upper < half:
+                    write_bit(0)
+                    lower = lower << 1
+                    upper = (upper << 1) | 1
+                    if e_3_counter:
+                        write_run(1, e_3_counter)
+                        e_3_counter = 0
+                elif lower >= half:
+                    write_bit(1)
+                    lower = (lower << 1) & mask
+                    upper = ((upper << 1) & mask) | 1
+                    if e_3_counter:
+                        write_run(0, e_3_counter)
+                        e_3_counter = 0
+                elif lower >= quarter and upper < three_quarters:
+                    lower = ((lower << 1) & mask) ^ half
+                    upper = (((upper << 1) & mask) | 1) ^ half
+                    e_3_counter += 1
+                else:
+                    break
+        self.lower, self.upper, self.context = lower, upper, context
+        self.e_3_mapping_counter = e_3_counter
+
+    def decode_bits(self, bits: BitReader, symbol_count: int) -> np.ndarray:
+        """
+        Decode symbol_count bits, looking up and updating the table as
+        the encoder does.
+
+        The tag is read from the start of bits.
+        """
+        decoded_message = BitWriter()
+        write_bit = decoded_message.write_bit
+        read_bit = bits.read_bit
+        zero_counts = self.zero_counts
+        total_counts = self.total_counts
+        checks = self.checks
+        rescale_limit = self.rescale_limit
+        context_mask = (1 << self.markov_order) - 1
+        hash_mask = (1 << HASH_BITS) - 1
+        slot_shift = HASH_BITS - self.table_bits
+        check_mask = (1 << CHECK_BITS) - 1
+        mask = (1 << self.word_length) - 1
+        half = 1 << (self.word_length - 1)
+        quarter = 1 << (self.word_length - 2)
+        three_quarters = half + quarter
+        tag = bits.read_int(self.word_length)
+        lower, upper, context = self.lower, self.upper, self.context
+        for _ in range(symbol_count):
+            hashed = (context*HASH_MULTIPLIER) & hash_mask
+            slot = hashed >> slot_shift
+            check = (hashed >> (slot_shift - CHECK_BITS)) & check_mask
+            if checks[slot] != check:
+                neighbour = slot ^ 1
+                if checks[neighbour] == check:
+                    slot = neighbour
+                else:
+                    if total_counts[neighbour] < total_counts[slot]:
+                        slot = neighbour
+                    checks[slot] = check
+                    zero_counts[slot] = 1
+                    total_counts[slot] = 2
+            zero_count = zero_counts[slot]
+            total = total_counts[slot]
+            factor = upper - lower + 1
+            split = factor*zero_count//total
+            if ((tag - lower + 1)*total - 1)//factor < zero_count:
+                bit = 0
+                upper = lower + split - 1
+                zero_count += 1
+            else:
+                bit = 1
+                lower += split
+            write_bit(bit)
+            total += 1
+            if total > rescale_limit:
+                one_count = total - zero_count
+                zero_count = (zero_count + 1) >> 1
+                total = zero_count + ((one_count + 1) >> 1)
+            zero_counts[slot] = zero_count
+            total_counts[slot] = total
+            context = ((context << 1) | bit) & context_mask
+            while True:
+                if upper < half:
+                    lower = lower << 1
+                    upper = (upper << 1) | 1
+                    tag = ((tag << 1) & mask) | read_bit()
+                elif lower >= half:
+                    lower = (lower << 1) & mask
+                    upper = ((upper << 1) & mask) | 1
+                    tag = ((tag << 1) & mask) | read_bit()
+                elif lower >= quarter and upper < three_quarters:
+                    lower = ((lower << 1) & mask) ^ half
+                    upper = (((upper << 1) & mask) | 1) ^ half
+                    tag = (((tag << 1) & mask) | read_bit()) ^ half
+                else:
+                    break
+        self.tag, self.lower, self.upper, self.context = tag, lower, upper, context
+        return decoded_message.to_array()
@@ -0,0 +1,271 @@
+import numpy as np
+
+from bitio import BitReader, BitWriter
+from fastlimits import FastMBitLimits
+from tracing import CodingCounters, Tracer
+
+HOT_PROBABILITY = 0.95
+MIN_HOT_RUN = 4
+
+
+class HotMBitLimits(FastMBitLimits):
+    """
+    Execute the same arithmetic coding as FastMBitLimits, taking a fast
+    path through runs of the likely bit of highly skewed contexts.
+
+    A run of zeros ends in the context of (order) zeros, and a run of
+    ones in the context of (order) ones, where the context no longer
+    changes. When the bit of the run has a probability of at least
+    HOT_PROBABILITY there, the context is hot, and its likely bit, zero
+    count and total count go in a table built once with the model, so
+    coding in chunks doesn't build it again for every chunk. While a run
+    goes through a hot context, one of the limits stays fixed, the lower
+    one for zeros and the upper one for ones, so the interval is just its
+    width, which shrinks with a single multiplication and division per
+    symbol. The mappings can only be needed once the width gets to a
+    limit that only depends on the fixed limit, so until then no mapping
+    is checked and no limit is updated, and the encoder codes the run a
+    batch at a time, between one renormalization and the next. The
+    decoder still compares every symbol with the tag, but against a
+    single bound. The encoded and decoded messages are bit-identical to
+    the ones of FastMBitLimits.
+
+    Every bit written still takes a renormalization, as in the usual
+    loop, so the fast path only pays for itself in contexts skewed
+    enough that many symbols go by between renormalizations, which is
+    why HOT_PROBABILITY is high.
+
+    Instrumented coding goes through the loops of FastMBitLimits.
+    """
+    hot_contexts: dict[int, tuple[int, int, int]]
+    hot_bits: list[int]
+
+    def __init__(self, markov_order: int, occurrences: dict[str, int]|np.ndarray, tracer: Tracer|None = None,
+                 counters: CodingCounters|None = None, precision: int|None = None) -> None:
+        super().__init__(markov_order, occurrences, tracer, counters, precision)
+        self.hot_contexts = dict()
+        for bit, context in ((0, 0), (1, (1 << markov_order) - 1)):
+            zero_count = self.zero_counts[context]
+            total = self.total_counts[context]
+            likely_count = total - zero_count if bit else zero_count
+            if likely_count >= HOT_PROBABILITY*total:
+                self.hot_contexts[context] = (bit, zero_count, total)
+        self.hot_bits = [bit for bit, _, _ in self.hot_contexts.values()]
+
+    def encode_bits(self, bit_array: np.ndarray, writer: BitWriter) -> None:
+        """
+        Encode bits without ending the encoded message.
+
+        Runs of the likely bit of a hot context that are at least
+        MIN_HOT_RUN bits longer than the order are found beforehand.
+        The first (order) bits of each of them, which bring the context
+        to the hot one, and the bits between them go through the usual
+        loop, and the rest of the run through the fast path. The limits,
+        the context and the E_3 mapping counter are kept between calls,
+        as in FastMBitLimits.
+        """
+        hot_contexts = self.hot_contexts
+        if self.counters is not None or not hot_contexts or not bit_array.size:
+            super().encode_bits(bit_array, writer)
+            return
+        write_bit = writer.write_bit
+        write_run = writer.write_run
+        zero_counts = self.zero_counts
+        total_counts = self.total_counts
+        context_mask = (1 << self.markov_order) - 1
+        mask = (1 << self.word_length) - 1
+        half = 1 << (self.word_length - 1)
+        quarter = 1 << (self.word_length - 2)
+        three_quarters = half + quarter
+        lower, upper, context = self.lower, self.upper, self.context
+        e_3_counter = self.e_3_mapping_counter
+        bits = bit_array.tolist()
+        position = 0
+        for hot_start, hot_length in self._hot_runs(bit_array):
+            for bit in bits[position:hot_start]:
+                factor = upper - lower + 1
+                split = factor*zero_counts[context]//total_counts[context]
+                if bit:
+                    lower += split
+                else:
+                    upper = lower + split - 1
+                context = ((context << 1) | bit) & context_mask
+                while True:
+                    if upper < half:
+                        write_bit(0)
+                        lower = lower << 1
+                        upper = (upper << 1) | 1
+                        if e_3_counter:
+                            write_run(1, e_3_counter)
+                            e_3_counter = 0
+                    elif lower >= half:
+                        write_bit(1)
+                        lower = (lower << 1) & mask
+                        upper = ((upper << 1) & mask) | 1
+                        if e_3_counter:
+                            write_run(0, e_3_counter)
+                            e_3_counter = 0
+                    elif lower >= quarter and upper < three_quarters:
+                        lower = ((lower << 1) & mask) ^ half
+                        upper = (((upper << 1) & mask) | 1) ^ half
+                        e_3_counter += 1
+                    else:
+                        break
+            position = hot_start + hot_length
+            if not hot_length:
+                continue
+            bit, zero_count, total = hot_contexts[context]
+            width = upper - lower + 1
+            remaining = hot_length
+            while remaining:
+                if bit:
+                    limit = upper + 1 - (quarter if upper < three_quarters else half)
+                    for step in range(1, remaining + 1):
+                        width -= width*zero_count//total
+                        if width <= limit:
+                            break
+                    lower = upper - width + 1
+                else:
+                    limit = (three_quarters if lower >= quarter else half) - lower
+                    for step in range(1, remaining + 1):
+                        width = width*zero_count//total
+                        if width <= limit:
+                            break
+                    upper = lower + width - 1
+                remaining -= step
+                if width > limit:
+                    break
+                while True:
+                    if upper < half:
+                        write_bit(0)
+                        lower = lower << 1
+                        upper = (upper << 1) | 1
+                        if e_3_counter:
+                            write_run(1, e_3_counter)
+                            e_3_counter = 0
+                    elif lower >= half:
+                        write_bit(1)
+                        lower = (lower << 1) & mask
+                        upper = ((upper << 1) & mask) | 1
+                        if e_3_counter:
+                            write_run(0, e_3_counter)
+                            e_3_counter = 0
+                    elif lower >= quarter and upper < three_quarters:
+                        lower = ((lower << 1) & mask) ^ half
+                        upper = (((upper << 1) & mask) | 1) ^ half
+                        e_3_counter += 1
+                    else:
+                        break
+                width = upper - lower + 1
+        self.lower, self.upper, self.context = lower, upper, context
+        self.e_3_mapping_counter = e_3_counter
+
+    def _hot_runs(self, bit_array: np.ndarray) -> list[tuple[int, int]]:
+        """
+        Return where the fast path of every long run of a likely bit
+        starts and how long it is.
+
+        The fast path of a run starts (order) bits after the run does,
+        when the context is the hot one for sure. The list ends with an
+        empty run at the end of bit_array, so the bits after the last
+        run are coded as well.
+        """
+        markov_order = self.markov_order
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(bit_array)) + 1))
+        lengths = np.diff(np.append(starts, bit_array.size))
+        run_bits = bit_array[starts]
+        long_runs = np.isin(run_bits, self.hot_bits) & (lengths >= markov_order + MIN_HOT_RUN)
+        hot_starts = starts[long_runs] + markov_order
+        hot_runs = list(zip(hot_starts.tolist(), (lengths[long_runs] - markov_order).tolist()))
+        hot_runs.append((bit_array.size, 0))
+        return hot_runs
+
+    def decode_bits(self, bits: BitReader, symbol_count: int, resume: bool = False) -> np.ndarray:
+        """
+        Decode symbol_count bits, starting from the current limits and
+        context, as FastMBitLimits does.
+
+        In a hot context, the likely bit is decoded for as long as the
+        tag stays on its side of the split and the width stays over the
+        renormalization limit. The symbol that ends the run goes through
+        the usual loop, which carries on until the context is hot again.
+        """
+        hot_contexts = self.hot_contexts
+        if self.counters is not None or not hot_contexts:
+            return super().decode_bits(bits, symbol_count, resume)
+        decoded_message = BitWriter()
+        write_bit = decoded_message.write_bit
+        write_run = decoded_message.write_run
+        read_bit = bits.read_bit
+        zero_counts = self.zero_counts
+        total_counts = self.total_counts
+        context_mask = (1 << self.markov_order) - 1
+        mask = (1 << self.word_length) - 1
+        half = 1 << (self.word_length - 1)
+        quarter = 1 << (self.word_length - 2)
+        three_quarters = half + quarter
+        tag = self.tag if resume else bits.read_int(self.word_length)
+        lower, upper, context = self.lower, self.upper, self.context
+        decoded_count = 0
+        while decoded_count < symbol_count:
+            if context in hot_contexts:
+                run_bit, zero_count, total = hot_contexts[context]
+                width = upper - lower + 1
+                offset = tag - lower
+                left = symbol_count - decoded_count
+                if run_bit:
+                    limit = upper + 1 - (quarter if upper < three_quarters else half)
+                    for run_length in range(left):
+                        split = width*zero_count//total
+                        if offset < split or width - split <= limit:
+                            break
+                        offset -= split
+                        width -= split
+                    else:
+                        run_length = left
+                    lower = upper - width + 1
+                else:
+                    bound = max(offset, (three_quarters if lower >= quarter else half) - lower)
+                    for run_length in range(left):
+                        split = width*zero_count//total
+                        if split <= bound:
+                            break
+                        width = split
+                    else:
+                        run_length = left
+                    upper = lower + width - 1
+                if run_length:
+                    write_run(run_bit, run_length)
+                    decoded_count += run_length
+            for decoded_count in range(decoded_count + 1, symbol_count + 1):
+                factor = upper - lower + 1
+                zero_count = zero_counts[context]
+                total = total_counts[context]
+                split = factor*zero_count//total
+                if ((tag - lower + 1)*total - 1)//factor < zero_count:
+                    bit = 0
+                    upper = lower + split - 1
+                else:
+                    bit = 1
+                    lower += split
+                write_bit(bit)
+                context = ((context << 1) | bit) & context_mask
+                while True:
+                    if upper < half:
+                        lower = lower << 1
+                        upper = (upper << 1) | 1
+                        tag = ((tag << 1) & mask) | read_bit()
+                    elif lower >= half:
+                        lower = (lower << 1) & mask
+                        upper = ((upper << 1) & mask) | 1
+                        tag = ((tag << 1) & mask) | read_bit()
+                    elif lower >= quarter and upper < three_quarters:
+                        lower = ((lower << 1) & mask) ^ half
+                        upper = (((upper << 1) & mask) | 1) ^ half
+                        tag = (((tag << 1) & mask) | read_bit()) ^ half
+                    else:
+                        break
+                if context in hot_contexts:
+                    break
+        self.tag, self.lower, self.upper, self.context = tag, lower, upper, context
+        return decoded_message.to_array()
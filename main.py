@@ -5,8 +5,9 @@ import numpy as np
 import occurrences as oc
 import read as r
 from mbitlimits import MBitLimits
-from encode import _header_string, ORDER, encoded_bytes
-from converter import bit_array_to_bytes, bit_string_to_array
+from bitio import BitWriter
+from encode import _write_header, ORDER, encoded_bytes
+from converter import bit_array_to_bytes
 #from unused_functions import generate_sequence
 
 DATA_PATH = Path(r'modelo2.dat')
@@ -25,19 +26,20 @@ def main():
     encoded_message = limits.encode(bit_array)
     #print(len(encoded_message), len(encoded_message)%8, limits.padding_number)
     print(len(encoded_message))
-    print(f'{encoded_message}:', len(encoded_message)//8, 'bytes', f'; Padding bits: {limits.padding_number}')
+    print(f'{encoded_message.to_bytes()}:', len(encoded_message)//8, 'bytes', f'; Padding bits: {limits.padding_number}')
     print(r'%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
 
-    header = _header_string(limits.padding_number, ORDER, occurrence_dictionary)
+    header = BitWriter()
+    _write_header(header, limits.padding_number, ORDER, oc.counts_from_occurrence_dict(occurrence_dictionary, ORDER))
     #print(len(header))
     #compressed = encoded_bytes(ORDER)
     #print(len(compressed))
 
-    order, occurrence_dict, message = r.separate_encoded_message(''.join((header, encoded_message)))
+    order, occurrence_dict, message = r.separate_encoded_message(b''.join((header.to_bytes(), encoded_message.to_bytes())))
     decode_limits = MBitLimits(order, occurrence_dict)
     decoded_message = decode_limits.decode(message)
     print('Hello World!', decoded_message)
-    decoded_array = bit_string_to_array(decoded_message)
+    decoded_array = decoded_message
     print(len(decoded_message), print(decoded_array))
 
     # print(decoded_array[:10] == bit_array[:10])
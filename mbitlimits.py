@@ -1,7 +1,8 @@
 import numpy as np
 
-from occurrences import cumulative_count_tuple, total_count
-from converter import bit_array_to_int
+from bitio import BitReader, BitWriter
+from occurrences import cumulative_count_tuple, sequence_length, total_count
+from tracing import CodingCounters, Tracer
 
 
 class MBitLimits:
@@ -12,6 +13,9 @@ class MBitLimits:
     implementation for the arithmetic coding and, by doing so, it
     allows for the execution of the algorithm. Other important
     attributes are stored.
+
+    A tracer or counters can be given to follow the mappings, as with
+    FastMBitLimits. HistoryTracer records the limits after every symbol.
     """
     occurrence_dict: dict[str, int]
     e_3_mapping_counter: int
@@ -21,10 +25,11 @@ class MBitLimits:
     lower: int
     upper: int
     bits: str
-    historic_lower: list[int]
-    historic_upper: list[int]
+    tracer: Tracer|None
+    counters: CodingCounters|None
 
-    def __init__(self, markov_order: int, occurrence_dict: dict[str, int]) -> None:
+    def __init__(self, markov_order: int, occurrence_dict: dict[str, int], tracer: Tracer|None = None,
+                 counters: CodingCounters|None = None) -> None:
         self.word_length = int(2 + np.ceil(np.log2(sum(occurrence_dict.values()))))
         self.tag = 0
         self.lower = 0
@@ -32,8 +37,10 @@ class MBitLimits:
         self.bits = ''.join(['0' for i in range(markov_order+1)])
         self.occurrence_dict = occurrence_dict
         self.e_3_mapping_counter = 0
-        self.historic_lower = [self.lower]
-        self.historic_upper = [self.upper]
+        if tracer is not None and counters is None:
+            counters = CodingCounters()
+        self.tracer = tracer
+        self.counters = counters
 
     def __repr__(self) -> str:
         """
@@ -76,10 +83,10 @@ class MBitLimits:
         """Decode a bit given tag while updating limits."""
         tag_factor = self.tag - self.lower + 1
         upper_factor = self.upper - self.lower + 1
-        numerator = tag_factor*total_count(self.bits, self.occurrence_dict) - 1
-        value_to_compare = numerator//upper_factor
         previous_bits = self.bits[1:]
         cum_tuple_string = ''.join((previous_bits, '1'))
+        numerator = tag_factor*total_count(cum_tuple_string, self.occurrence_dict) - 1
+        value_to_compare = numerator//upper_factor
         cum_count_0, _ = cumulative_count_tuple(cum_tuple_string, self.occurrence_dict)
         decoded_bit = 0 if value_to_compare < cum_count_0 else 1
         self._get_bit(decoded_bit)
@@ -94,8 +101,6 @@ class MBitLimits:
         numerator_upper = factor*cum_tuple[1]
         self.upper = self.lower + numerator_upper//denominator - 1
         self.lower = self.lower + numerator_lower//denominator
-        self.historic_lower.append(self.lower)
-        self.historic_upper.append(self.upper)
 
     def _shift_limits(self) -> None:
         """
@@ -150,77 +155,131 @@ class MBitLimits:
         else:
             return 0
 
-    def encode(self, bit_array: np.ndarray) -> str:
+    def _context(self) -> int:
+        """Return the (order) previous bits as an integer, as FastMBitLimits keeps them."""
+        return int(self.bits[1:], 2) if len(self.bits) > 1 else 0
+
+    def encode(self, bit_array: np.ndarray, writer: BitWriter|None = None) -> BitWriter:
         """Return encoded message."""
-        encoded_message = []
-        iteration = 0
-        for bit in bit_array:
+        if writer is None:
+            writer = BitWriter()
+        start_length = len(writer)
+        if self.counters is None:
+            self._encode_bits(bit_array, writer)
+        else:
+            with self.counters.phase('encode'):
+                self._traced_encode_bits(bit_array, writer)
+        writer.write_bit(self.lower_left_most_bit)
+        complement = (self.lower_left_most_bit + 1) % 2
+        writer.write_run(complement, self.e_3_mapping_counter)
+        writer.write_int(self.lower % 2**(self.word_length - 1), self.word_length - 1)
+        self.padding_number = (8 - ((len(writer) - start_length) % 8)) % 8
+        writer.write_int(0, self.padding_number)
+        if self.counters is not None:
+            self.counters.symbols += bit_array.size
+            self.counters.coded_bits += len(writer) - start_length
+        return writer
+
+    def _encode_bits(self, bit_array: np.ndarray, writer: BitWriter) -> None:
+        """Encode bits without ending the encoded message."""
+        for bit in bit_array.tolist():
+            self._get_bit(bit)
+            while mapping := self._decide_mapping():
+                if mapping == 1 or mapping == 2:
+                    bit = self.lower_left_most_bit
+                    writer.write_bit(bit)
+                    self._shift_limits()
+                    complement = (bit + 1) % 2
+                    writer.write_run(complement, self.e_3_mapping_counter)
+                    self.e_3_mapping_counter = 0
+                else:
+                    self._shift_limits()
+                    self._complement_left_most_bit()
+                    self.e_3_mapping_counter += 1
+
+    def _traced_encode_bits(self, bit_array: np.ndarray, writer: BitWriter) -> None:
+        """Encode bits as _encode_bits does, counting mappings and calling the tracer."""
+        counters = self.counters
+        tracer = self.tracer
+        for bit in bit_array.tolist():
             self._get_bit(bit)
-            if iteration < 20:
-                print(f'{bit = }, {self}')
-            while self._decide_mapping():
-                if self._decide_mapping() == 1 or self._decide_mapping() == 2:
-                    if iteration < 20:
-                            print(f'ENCODING: Mapping {self._decide_mapping()}', f'{iteration = }', sep='; ')
+            if tracer is not None:
+                tracer('symbol', self.lower, self.upper, self._context())
+            while mapping := self._decide_mapping():
+                if mapping == 1 or mapping == 2:
                     bit = self.lower_left_most_bit
-                    encoded_message.append(str(bit))
+                    writer.write_bit(bit)
                     self._shift_limits()
-                    for _ in range(self.e_3_mapping_counter):
-                        complement = (bit + 1) % 2
-                        encoded_message.append(str(complement))
+                    complement = (bit + 1) % 2
+                    writer.write_run(complement, self.e_3_mapping_counter)
+                    counters.max_e_3_run = max(counters.max_e_3_run, self.e_3_mapping_counter)
                     self.e_3_mapping_counter = 0
-                if self._decide_mapping() == 3:
-                    if iteration < 20:
-                            print(f'ENCODING: Mapping {self._decide_mapping()}', f'{iteration = }', sep='; ')
+                else:
                     self._shift_limits()
                     self._complement_left_most_bit()
                     self.e_3_mapping_counter += 1
-                if iteration < 20:
-                    print(self)
-            iteration += 1
-        lower_string = f'{self.lower:0{self.word_length}b}'
-        encoded_message.append(lower_string[0])
-        complement = (int(lower_string) + 1) % 2
-        for _ in range(self.e_3_mapping_counter):
-            encoded_message.append(str(complement))
-        encoded_message.append(lower_string[1:])
-        encoded_string = ''.join(encoded_message)
-        self.padding_number = (8 - (len(encoded_string) % 8)) % 8
-        padding_string = ''.join('0' for i in range(self.padding_number))
-        return ''.join((encoded_string, padding_string))
-
-    def decode(self, bit_array: np.ndarray) -> str:
-        """Return decoded message."""
-        decoded_message = []
-        self.tag = bit_array_to_int(bit_array[0:self.word_length])
-        array_index = self.word_length
-        iteration = 0
-        while self.tag != self.lower:
-            decoded_message.append(str(self._decode_bit()))
-            if iteration < 20:
-                print(f'bit = {self.bits[-1]}, {self}')
-            try:
-                while self._decide_mapping():
-                    if self._decide_mapping() == 1 or self._decide_mapping() == 2:
-                        if iteration < 20:
-                            print(f'DECODING: Mapping {self._decide_mapping()}', f'{iteration = }', sep='; ')
-                        self._shift_limits()
-                        next_bit = int(bit_array[array_index])
-                        array_index += 1
-                        self._shift_tag(next_bit)
-                    if self._decide_mapping() == 3:
-                        if iteration < 20:
-                            print(f'DECODING: Mapping {self._decide_mapping()}', f'{iteration = }', sep='; ')
-                        self._shift_limits()
-                        next_bit = int(bit_array[array_index])
-                        array_index += 1
-                        self._shift_tag(next_bit)
-                        self._complement_left_most_bit()
-                    if iteration < 20:
-                        print(self)
-                iteration += 1
-            except IndexError:
-                print("Warning: algorithm didn't stop.")
-                return ''.join(decoded_message)
-        print(f'{iteration = }, {self.tag}, {self.lower}')
-        return ''.join(decoded_message)
+                setattr(counters, f'e_{mapping}', getattr(counters, f'e_{mapping}') + 1)
+                if tracer is not None:
+                    tracer(f'e_{mapping}', self.lower, self.upper, self._context())
+        counters.max_e_3_run = max(counters.max_e_3_run, self.e_3_mapping_counter)
+
+    def decode(self, bits: np.ndarray|BitReader, symbol_count: int|None = None) -> np.ndarray:
+        """
+        Return decoded message.
+
+        Decoding stops after symbol_count bits. If it is not given, it
+        is inferred from the occurrence dictionary, which counts every
+        window of (order + 1) bits of the message on top of the initial
+        count of one.
+        """
+        if isinstance(bits, np.ndarray):
+            bits = BitReader.from_array(bits)
+        if symbol_count is None:
+            symbol_count = sequence_length(self.occurrence_dict, len(self.bits) - 1)
+        if self.counters is None:
+            return self._decode_bits(bits, symbol_count)
+        start_position = bits.position
+        with self.counters.phase('decode'):
+            decoded_message = self._traced_decode_bits(bits, symbol_count)
+        self.counters.symbols += symbol_count
+        self.counters.coded_bits += bits.position - start_position
+        return decoded_message
+
+    def _decode_bits(self, bits: BitReader, symbol_count: int) -> np.ndarray:
+        """Decode symbol_count bits, reading the tag from the start of bits."""
+        decoded_message = BitWriter()
+        self.tag = bits.read_int(self.word_length)
+        for _ in range(symbol_count):
+            decoded_message.write_bit(self._decode_bit())
+            while mapping := self._decide_mapping():
+                self._shift_limits()
+                self._shift_tag(bits.read_bit())
+                if mapping == 3:
+                    self._complement_left_most_bit()
+        return decoded_message.to_array()
+
+    def _traced_decode_bits(self, bits: BitReader, symbol_count: int) -> np.ndarray:
+        """Decode bits as _decode_bits does, counting mappings and calling the tracer."""
+        counters = self.counters
+        tracer = self.tracer
+        decoded_message = BitWriter()
+        self.tag = bits.read_int(self.word_length)
+        e_3_run = 0
+        for _ in range(symbol_count):
+            decoded_message.write_bit(self._decode_bit())
+            if tracer is not None:
+                tracer('symbol', self.lower, self.upper, self._context())
+            while mapping := self._decide_mapping():
+                self._shift_limits()
+                self._shift_tag(bits.read_bit())
+                if mapping == 3:
+                    self._complement_left_most_bit()
+                    e_3_run += 1
+                else:
+                    counters.max_e_3_run = max(counters.max_e_3_run, e_3_run)
+                    e_3_run = 0
+                setattr(counters, f'e_{mapping}', getattr(counters, f'e_{mapping}') + 1)
+                if tracer is not None:
+                    tracer(f'e_{mapping}', self.lower, self.upper, self._context())
+        counters.max_e_3_run = max(counters.max_e_3_run, e_3_run)
+        return decoded_message.to_array()
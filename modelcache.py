@@ -0,0 +1,107 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+
+from occurrences import derived_counts, multi_order_counts
+
+MODEL_CACHE_PATH = Path(r'.model_cache')
+MODEL_CACHE_SIZE = 2**26
+
+
+def content_hash(data: bytes) -> str:
+    """Return the hash that identifies data in the model cache."""
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+class ModelCache:
+    """
+    Keep built occurrence counts on disk, keyed by content hash and order.
+
+    Every model is a .npy file in the cache directory. Reading a model
+    touches its file, so the modification times order the models from
+    least to most recently used, and whenever the files add up to more
+    than max_size bytes the least recently used ones are removed. Models
+    are written to a temporary file first and then renamed, so a reader
+    never sees half a model, even with several processes sharing the
+    directory.
+    """
+    directory: Path
+    max_size: int
+
+    def __init__(self, directory: Path = MODEL_CACHE_PATH, max_size: int = MODEL_CACHE_SIZE) -> None:
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, digest: str, markov_order: int) -> Path:
+        return self.directory / f'{digest}-{markov_order}.npy'
+
+    def get(self, digest: str, markov_order: int) -> np.ndarray|None:
+        """Return the cached counts of some content and order, if there are any."""
+        path = self._path(digest, markov_order)
+        try:
+            counts = np.load(path)
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        return counts
+
+    def put(self, digest: str, markov_order: int, counts: np.ndarray) -> None:
+        """Store the counts of some content and order, then evict models if needed."""
+        path = self._path(digest, markov_order)
+        temporary_path = path.with_name(f'{path.stem}.{os.getpid()}.tmp')
+        with open(temporary_path, 'wb') as file:
+            np.save(file, counts)
+        os.replace(temporary_path, path)
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used models until the cache fits in max_size bytes."""
+        entries = []
+        for path in self.directory.glob('*.npy'):
+            try:
+                status = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((status.st_mtime, status.st_size, path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            total_size -= size
+
+    def counts(self, data: bytes, markov_orders: Iterable[int]) -> dict[int, np.ndarray]:
+        """
+        Return the occurrence counts of data for every order.
+
+        Orders that are cached are loaded. The others are derived from a
+        cached higher order if there is one, and otherwise built with
+        multi_order_counts, counting data only once. Built models are
+        cached for the next time.
+        """
+        digest = content_hash(data)
+        markov_orders = sorted(set(markov_orders))
+        models = dict()
+        for markov_order in markov_orders:
+            counts = self.get(digest, markov_order)
+            if counts is not None:
+                models[markov_order] = counts
+        missing = [markov_order for markov_order in markov_orders if markov_order not in models]
+        if not missing:
+            return models
+        bit_array = np.unpackbits(np.frombuffer(data, dtype=np.uint8)).view(np.int8)
+        higher_orders = [markov_order for markov_order in models if markov_order > missing[-1]]
+        if higher_orders:
+            highest_order = higher_orders[0]
+            built = {markov_order: derived_counts(models[highest_order], highest_order, markov_order, bit_array)
+                     for markov_order in missing}
+        else:
+            built = multi_order_counts(bit_array, missing)
+        for markov_order, counts in built.items():
+            self.put(digest, markov_order, counts)
+        models.update(built)
+        return models
@@ -1,26 +1,36 @@
+from typing import Iterable
+
 import numpy as np
 
 
-def _cut_and_reshape(array: np.ndarray, index: int, markov_order: int) -> np.ndarray:
+CHUNK_SIZE = 2**23
+
+
+def _window_dtype(markov_order: int) -> type:
+    """Return the smallest unsigned type that holds an (order + 1) bit code."""
+    if markov_order < 16:
+        return np.uint16
+    if markov_order < 32:
+        return np.uint32
+    return np.uint64
+
+
+def window_codes(sequence: np.ndarray, markov_order: int) -> np.ndarray:
     """
-    Cut the array and reshape it.
-    
-    Given an index, cut the array at that index such that
-    the cut array has a length that is a multiple of one plus
-    the order of Markov used in the algorithm. Then reshape
-    the array such that each row has the number of elements equal
-    to the order plus one.
+    Return the code of every overlapping window of (order + 1) bits.
+
+    The code of a window is the integer whose binary digits are the
+    bits of the window, so a sequence of n bits has (n - order) codes.
     """
-    order_plus_one = markov_order + 1
-    remainder = (array.size%order_plus_one)
-    if index - remainder < 0:
-        bit_array_cut = array[index:index-remainder]
-    elif index - remainder == 0:
-        bit_array_cut = array[index:]
-    else:
-        bit_array_cut = array[index:index-remainder-order_plus_one]
-    bit_array_reshaped = bit_array_cut.reshape((bit_array_cut.size//order_plus_one, order_plus_one))
-    return bit_array_reshaped
+    window_count = sequence.size - markov_order
+    dtype = _window_dtype(markov_order)
+    codes = np.zeros(max(window_count, 0), dtype=dtype)
+    if window_count <= 0:
+        return codes
+    for i in range(markov_order + 1):
+        codes <<= 1
+        codes |= sequence[i:i+window_count].astype(dtype)
+    return codes
 
 
 def _initialize_dict(markov_order: int) -> dict[str, int]:
@@ -33,23 +43,144 @@ def _initialize_dict(markov_order: int) -> dict[str, int]:
     return occurrence_dictionary
 
 
-def _update_ocurrence_dict(unique_tuple: tuple[np.ndarray, np.ndarray], ocurrence_dictionary: dict[str, int]) -> dict[str, int]:
-    """Return updated occurrence dictionary."""
-    for j in range(unique_tuple[0].shape[0]):
-        occurrence = ''.join([str(char) for char in unique_tuple[0][j].tolist()])
-        ocurrence_dictionary[occurrence] += unique_tuple[1][j]
-    return ocurrence_dictionary
+def occurrence_counts_from_chunks(chunks: Iterable[np.ndarray], markov_order: int) -> np.ndarray:
+    """
+    Obtain occurrence counts from a sequence of bits given in chunks.
+
+    The last (order) bits of each chunk are carried to the next one, so
+    windows crossing the boundary between chunks are counted as well.
+    Position i of the returned array is the count of the window whose
+    code is i, plus one.
+    """
+    size = 2**(markov_order + 1)
+    counts = np.ones(size, dtype=np.int64)
+    carry = np.zeros(0, dtype=np.int8)
+    for chunk in chunks:
+        sequence = np.concatenate((carry, chunk)) if carry.size else chunk
+        counts += np.bincount(window_codes(sequence, markov_order), minlength=size)
+        carry = sequence[-markov_order:] if markov_order else carry
+    return counts
+
+
+def occurrence_counts(sequence: np.ndarray, markov_order: int, chunk_size: int = CHUNK_SIZE) -> np.ndarray:
+    """Obtain occurrence counts from sequence of bits."""
+    chunks = (sequence[i:i+chunk_size] for i in range(0, sequence.size, chunk_size))
+    return occurrence_counts_from_chunks(chunks, markov_order)
+
+
+def derived_counts(counts: np.ndarray, markov_order: int, lower_order: int, head: np.ndarray) -> np.ndarray:
+    """
+    Obtain the occurrence counts of a lower order from the ones of a
+    higher order.
+
+    Summing the windows of (order + 1) bits over their leading bits
+    counts every window of (lower order + 1) bits except for the ones
+    that start in the first (order - lower order) bits of the sequence,
+    so those are counted from head, the first (order) bits.
+    """
+    windows = (counts - 1).reshape(2**(markov_order - lower_order), 2**(lower_order + 1)).sum(axis=0)
+    windows += np.bincount(window_codes(head[:markov_order], lower_order), minlength=windows.size)
+    return windows + 1
+
+
+def multi_order_counts(sequence: np.ndarray, markov_orders: Iterable[int],
+                       chunk_size: int = CHUNK_SIZE) -> dict[int, np.ndarray]:
+    """
+    Obtain occurrence counts of several orders from sequence of bits.
+
+    The sequence is only counted at the highest order, and the counts of
+    every other order are derived from those.
+    """
+    markov_orders = sorted(set(markov_orders))
+    if not markov_orders:
+        return dict()
+    highest_order = markov_orders[-1]
+    counts = occurrence_counts(sequence, highest_order, chunk_size)
+    head = sequence[:highest_order]
+    return {markov_order: derived_counts(counts, highest_order, markov_order, head) if markov_order < highest_order
+            else counts for markov_order in markov_orders}
+
+
+def rescaled_counts(occurrences: np.ndarray, markov_order: int, count_bits: int) -> np.ndarray:
+    """
+    Return occurrence counts whose total in every context is at most
+    2^(count bits).
+
+    Both counts of a context over the bound are halved, rounding up so
+    none of them gets to zero, as many times as it takes, the same way
+    AdaptiveMBitLimits rescales its counts. Contexts under the bound
+    keep their counts.
+    """
+    pairs = occurrences.reshape(2**markov_order, 2).copy()
+    bound = 1 << count_bits
+    while (over := pairs.sum(axis=1) > bound).any():
+        pairs[over] = (pairs[over] + 1) >> 1
+    return pairs.reshape(-1)
+
+
+def occurrence_dict_from_counts(counts: np.ndarray, markov_order: int) -> dict[str, int]:
+    """Obtain occurrence dictionary from occurrence counts."""
+    order_plus_one = markov_order + 1
+    return {f'{i:0{order_plus_one}b}': count for i, count in enumerate(counts.tolist())}
+
+
+def counts_from_occurrence_dict(occurrence_dict: dict[str, int], markov_order: int) -> np.ndarray:
+    """Obtain occurrence counts from occurrence dictionary."""
+    order_plus_one = markov_order + 1
+    occurrences = (occurrence_dict[f'{i:0{order_plus_one}b}'] for i in range(2**order_plus_one))
+    return np.fromiter(occurrences, dtype=np.int64, count=2**order_plus_one)
 
 
 def occurrence_dict_from_sequence(sequence: np.ndarray, markov_order: int) -> dict[str, int]:
     """Obtain occurrence dictionary from sequence of bits."""
-    order_plus_one = markov_order + 1
-    occurrence_dictionary = _initialize_dict(markov_order)
-    for i in range(order_plus_one):
-        bit_array_reshaped = _cut_and_reshape(sequence, i, markov_order)
-        unique_tuple = np.unique(bit_array_reshaped, axis=0, return_counts=True)
-        occurrence_dictionary = _update_ocurrence_dict(unique_tuple, occurrence_dictionary)
-    return occurrence_dictionary
+    counts = occurrence_counts(sequence, markov_order)
+    return occurrence_dict_from_counts(counts, markov_order)
+
+
+def sequence_length(occurrences: dict[str, int]|np.ndarray, markov_order: int) -> int:
+    """
+    Return the length of the sequence some occurrence counts count.
+
+    A sequence of n bits has (n - order) windows of (order + 1) bits,
+    each counted once on top of the initial count of one.
+    """
+    if isinstance(occurrences, dict):
+        occurrences = occurrences.values()
+    window_count = int(sum(occurrences)) - 2**(markov_order + 1)
+    return window_count + markov_order if window_count else 0
+
+
+def cumulative_array(occurrences: dict[str, int]|np.ndarray, markov_order: int) -> np.ndarray:
+    """
+    Create cumulative count array from occurrence counts.
+
+    The array has the same shape as the cumulative dictionary: row i
+    holds the cumulative counts of bits -1, 0 and 1 after the context
+    whose (order) bits are the binary digits of i.
+    """
+    if isinstance(occurrences, dict):
+        occurrences = counts_from_occurrence_dict(occurrences, markov_order)
+    cumulative = np.zeros((2**markov_order, 3), dtype=np.int64)
+    cumulative[:, 1:] = np.cumsum(occurrences.reshape(2**markov_order, 2), axis=1)
+    return cumulative
+
+
+def ideal_code_length(occurrences: dict[str, int]|np.ndarray, markov_order: int) -> float:
+    """
+    Return the ideal length in bits of the sequence some occurrence
+    counts count, when coded with those counts.
+
+    Every window costs minus the base 2 logarithm of its count over the
+    total count of its context, and there are as many of each window as
+    its count minus the initial count of one. This is the empirical
+    conditional entropy of the sequence, taken with the counts the
+    coder actually uses.
+    """
+    if isinstance(occurrences, dict):
+        occurrences = counts_from_occurrence_dict(occurrences, markov_order)
+    pairs = occurrences.reshape(2**markov_order, 2)
+    totals = pairs.sum(axis=1, keepdims=True)
+    return float(((pairs - 1)*np.log2(totals/pairs)).sum())
 
 
 def total_count(bits: str, occurrence_dict: dict[str, int]) -> int:
@@ -0,0 +1,142 @@
+import hashlib
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+
+from bitio import BitReader, BitWriter
+from fastlimits import FastMBitLimits
+from occurrences import window_codes
+
+MODEL_STORE_PATH = Path(r'models')
+MODEL_ID_SIZE = 4
+
+
+def record_counts(records: Iterable[bytes], markov_order: int) -> np.ndarray:
+    """
+    Obtain occurrence counts from many records at once.
+
+    Every record is coded on its own, starting from context zero, so
+    each one is counted as if it were preceded by (order) zeros, and
+    windows that would cross from one record into the next are left
+    out. All records are counted with a single pass over their bits.
+    """
+    records = [np.frombuffer(record, dtype=np.uint8) for record in records]
+    size = 2**(markov_order + 1)
+    if not records:
+        return np.ones(size, dtype=np.int64)
+    bit_lengths = np.array([8*record.size for record in records], dtype=np.int64) + markov_order
+    padding = np.zeros(markov_order, dtype=np.uint8)
+    bits = np.concatenate([part for record in records for part in (padding, np.unpackbits(record))]).view(np.int8)
+    codes = window_codes(bits, markov_order)
+    ends = np.cumsum(bit_lengths)
+    window_ends = np.repeat(ends, bit_lengths)[:codes.size]
+    inside = np.arange(codes.size) + markov_order < window_ends
+    return np.bincount(codes[inside], minlength=size) + 1
+
+
+class PretrainedModel:
+    """
+    Code short records with a model trained once on a sample of them.
+
+    A record is the model ID, in MODEL_ID_SIZE bytes, the amount of
+    bytes it holds, as a varint, and its encoded message, so the count
+    table is never sent. The limits are built once per model and only
+    restarted for every record, which starts again from context zero.
+    The model ID is taken from a hash of the order and the counts, so
+    the same training always gives the same ID.
+    """
+    markov_order: int
+    counts: np.ndarray
+    model_id: int
+    limits: FastMBitLimits
+
+    def __init__(self, markov_order: int, counts: np.ndarray) -> None:
+        self.markov_order = markov_order
+        self.counts = counts
+        digest = hashlib.blake2b(bytes((markov_order,)) + counts.astype('<i8').tobytes(), digest_size=MODEL_ID_SIZE)
+        self.model_id = int.from_bytes(digest.digest(), 'big')
+        self.limits = FastMBitLimits(markov_order, counts)
+
+    @classmethod
+    def train(cls, records: Iterable[bytes], markov_order: int) -> 'PretrainedModel':
+        """Train a model on a sample of records."""
+        return cls(markov_order, record_counts(records, markov_order))
+
+    def _restart(self) -> None:
+        self.limits.restart()
+        self.limits.context = 0
+
+    def encode(self, record: bytes) -> bytes:
+        """Return an encoded record."""
+        writer = BitWriter()
+        writer.write_int(self.model_id, 8*MODEL_ID_SIZE)
+        writer.write_varint(len(record))
+        self._restart()
+        self.limits.encode(np.unpackbits(np.frombuffer(record, dtype=np.uint8)).view(np.int8), writer)
+        return writer.to_bytes()
+
+    def decode(self, encoded: bytes) -> bytes:
+        """Return the record of an encoded record."""
+        reader = BitReader(encoded)
+        model_id = reader.read_int(8*MODEL_ID_SIZE)
+        if model_id != self.model_id:
+            raise ValueError(f'Record was encoded with model {model_id:08x}, not {self.model_id:08x}.')
+        byte_count = reader.read_varint()
+        self._restart()
+        bit_array = self.limits.decode(reader, 8*byte_count)
+        return np.packbits(bit_array.view(np.uint8)).tobytes()
+
+    def encode_batch(self, records: Iterable[bytes]) -> list[bytes]:
+        """Encode every record with the model."""
+        return [self.encode(record) for record in records]
+
+    def decode_batch(self, encoded_records: Iterable[bytes]) -> list[bytes]:
+        """Decode every record encoded with the model."""
+        return [self.decode(encoded) for encoded in encoded_records]
+
+
+def record_model_id(encoded: bytes) -> int:
+    """Return the ID of the model an encoded record needs."""
+    return int.from_bytes(encoded[:MODEL_ID_SIZE], 'big')
+
+
+class ModelStore:
+    """
+    Keep pretrained models on disk by ID.
+
+    Every model is an .npz file named after its ID. Loaded models stay
+    in memory, so decoding records of many models only reads and builds
+    each one once.
+    """
+    directory: Path
+    loaded: dict[int, PretrainedModel]
+
+    def __init__(self, directory: Path = MODEL_STORE_PATH) -> None:
+        self.directory = Path(directory)
+        self.loaded = dict()
+
+    def _path(self, model_id: int) -> Path:
+        return self.directory / f'{model_id:0{2*MODEL_ID_SIZE}x}.npz'
+
+    def save(self, model: PretrainedModel) -> int:
+        """Store a model and return its ID."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        np.savez(self._path(model.model_id), markov_order=model.markov_order, counts=model.counts)
+        self.loaded[model.model_id] = model
+        return model.model_id
+
+    def load(self, model_id: int) -> PretrainedModel:
+        """Return the model of an ID."""
+        if model_id not in self.loaded:
+            try:
+                with np.load(self._path(model_id)) as stored:
+                    model = PretrainedModel(int(stored['markov_order']), stored['counts'])
+            except FileNotFoundError:
+                raise KeyError(f'There is no model {model_id:08x}.') from None
+            self.loaded[model_id] = model
+        return self.loaded[model_id]
+
+    def decode_batch(self, encoded_records: Iterable[bytes]) -> list[bytes]:
+        """Decode records, each with the model its ID names."""
+        return [self.load(record_model_id(encoded)).decode(encoded) for encoded in encoded_records]
@@ -0,0 +1,112 @@
+import numpy as np
+
+from bitio import BYTE_SIZE, BitReader, BitWriter
+from fastlimits import FastMBitLimits
+from tracing import CodingCounters
+
+CODE_BITS = 64
+TOP = 1 << (CODE_BITS - BYTE_SIZE)
+BOTTOM = 1 << (CODE_BITS - 2*BYTE_SIZE)
+CODE_MASK = (1 << CODE_BITS) - 1
+
+
+class RangeMBitLimits(FastMBitLimits):
+    """
+    Execute range coding with the same model as FastMBitLimits.
+
+    Instead of shifting the limits out a bit at a time with the E_1,
+    E_2 and E_3 mappings, the low end and the width of the range are
+    kept in 64 bits and shifted out a whole byte at a time, as soon as
+    the top byte of the range is settled. Carries are avoided the way
+    Subbotin's range coder does it: when the range straddles a byte
+    boundary and has become too narrow, it is cut at the boundary
+    instead of counting underflow like E_3. Counts keep their full
+    precision as long as the total count of a context is under 2^48.
+
+    There are no mappings to count, so counters only add up the symbols,
+    the coded bits and the time spent.
+    """
+    low: int
+    range: int
+    code: int
+
+    def __init__(self, markov_order: int, occurrences: dict[str, int]|np.ndarray,
+                 counters: CodingCounters|None = None) -> None:
+        super().__init__(markov_order, occurrences, counters=counters)
+        if max(self.total_counts) > BOTTOM:
+            raise ValueError('Counts are too large for the range coder.')
+        self.restart()
+
+    def restart(self) -> None:
+        """Restart the range for a new encoded message, keeping the context."""
+        self.low = 0
+        self.range = CODE_MASK
+        self.code = 0
+
+    def encode_bits(self, bit_array: np.ndarray, writer: BitWriter) -> None:
+        """
+        Encode bits without ending the encoded message.
+
+        The range and the context are kept between calls.
+        """
+        write_int = writer.write_int
+        zero_counts = self.zero_counts
+        total_counts = self.total_counts
+        context_mask = (1 << self.markov_order) - 1
+        low, range_, context = self.low, self.range, self.context
+        for bit in bit_array.tolist():
+            zero_count = zero_counts[context]
+            step = range_ // total_counts[context]
+            if bit:
+                low += step*zero_count
+                range_ = step*(total_counts[context] - zero_count)
+            else:
+                range_ = step*zero_count
+            context = ((context << 1) | bit) & context_mask
+            while True:
+                if low ^ (low + range_) >= TOP:
+                    if range_ >= BOTTOM:
+                        break
+                    range_ = -low & (BOTTOM - 1)
+                write_int(low >> (CODE_BITS - BYTE_SIZE), BYTE_SIZE)
+                low = (low << BYTE_SIZE) & CODE_MASK
+                range_ = (range_ << BYTE_SIZE) & CODE_MASK
+        self.low, self.range, self.context = low, range_, context
+
+    def finish(self, writer: BitWriter) -> None:
+        """End the encoded message by writing every byte of the low end."""
+        writer.write_int(self.low, CODE_BITS)
+        self.padding_number = writer.pad()
+
+    def decode_bits(self, bits: BitReader, symbol_count: int) -> np.ndarray:
+        """Decode symbol_count bits, reading the code from the start of bits."""
+        decoded_message = BitWriter()
+        write_bit = decoded_message.write_bit
+        read_int = bits.read_int
+        zero_counts = self.zero_counts
+        total_counts = self.total_counts
+        context_mask = (1 << self.markov_order) - 1
+        code = read_int(CODE_BITS)
+        low, range_, context = self.low, self.range, self.context
+        for _ in range(symbol_count):
+            zero_count = zero_counts[context]
+            step = range_ // total_counts[context]
+            if (code - low) // step < zero_count:
+                bit = 0
+                range_ = step*zero_count
+            else:
+                bit = 1
+                low += step*zero_count
+                range_ = step*(total_counts[context] - zero_count)
+            write_bit(bit)
+            context = ((context << 1) | bit) & context_mask
+            while True:
+                if low ^ (low + range_) >= TOP:
+                    if range_ >= BOTTOM:
+                        break
+                    range_ = -low & (BOTTOM - 1)
+                code = ((code << BYTE_SIZE) & CODE_MASK) | read_int(BYTE_SIZE)
+                low = (low << BYTE_SIZE) & CODE_MASK
+                range_ = (range_ << BYTE_SIZE) & CODE_MASK
+        self.low, self.range, self.code, self.context = low, range_, code, context
+        return decoded_message.to_array()
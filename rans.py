@@ -0,0 +1,144 @@
+import numpy as np
+
+from bitio import BitReader, BitWriter
+from occurrences import cumulative_array, sequence_length
+
+LANES = 64
+PROBABILITY_BITS = 12
+PROBABILITY_SCALE = 1 << PROBABILITY_BITS
+WORD_BITS = 16
+STATE_LOWER_BOUND = 1 << 16
+
+
+def quantized_zero_counts(occurrences: dict[str, int]|np.ndarray, markov_order: int) -> np.ndarray:
+    """
+    Return the count of bit 0 after each context, out of a total of
+    2^PROBABILITY_BITS.
+
+    Each count is rounded to the nearest integer but kept between one
+    and the total minus one, so both bits can still be coded.
+    """
+    cumulative = cumulative_array(occurrences, markov_order)
+    scaled = np.rint(cumulative[:, 1]*PROBABILITY_SCALE/cumulative[:, 2])
+    return np.clip(scaled, 1, PROBABILITY_SCALE - 1).astype(np.int64)
+
+
+def _lane_contexts(lanes: np.ndarray, markov_order: int) -> np.ndarray:
+    """
+    Return the context before every bit of every lane.
+
+    The latest bit is the least significant one, as in FastMBitLimits,
+    and every lane starts from context zero.
+    """
+    contexts = np.zeros(lanes.shape, dtype=np.int64)
+    for i in range(1, min(markov_order, lanes.shape[1]) + 1):
+        contexts[:, i:] |= lanes[:, :lanes.shape[1]-i].astype(np.int64) << (i - 1)
+    return contexts
+
+
+class RansMBitLimits:
+    """
+    Execute interleaved rANS coding with the static occurrence counts.
+
+    The message is split into as many contiguous pieces as there are
+    lanes, and each piece is coded by its own rANS state, starting from
+    context zero. Since the lanes don't depend on each other, all of
+    them take a step at once as NumPy array operations, so decoding
+    takes one step per bit of the longest lane instead of one per bit of
+    the message. The counts are quantized to a total of
+    2^PROBABILITY_BITS, which costs a little compression.
+
+    The encoded message is the amount of lanes and of words, as
+    varints, the final state of every lane in 32 bits, and then the 16
+    bit words shifted out of the states, in the order the decoder reads
+    them.
+    """
+    markov_order: int
+    lanes: int
+    zero_counts: np.ndarray
+    symbol_count: int
+    padding_number: int
+
+    def __init__(self, markov_order: int, occurrences: dict[str, int]|np.ndarray, lanes: int = LANES) -> None:
+        self.markov_order = markov_order
+        self.lanes = lanes
+        self.zero_counts = quantized_zero_counts(occurrences, markov_order)
+        self.symbol_count = sequence_length(occurrences, markov_order)
+        self.padding_number = 0
+
+    def _lane_shape(self, symbol_count: int) -> tuple[int, np.ndarray]:
+        """Return the length of the longest lane and how many lanes are active at each step."""
+        lane_length = -(-symbol_count // self.lanes)
+        if not lane_length:
+            return 0, np.zeros(0, dtype=np.int64)
+        full_lanes, remainder = divmod(symbol_count, lane_length)
+        return lane_length, full_lanes + (np.arange(lane_length) < remainder)
+
+    def encode(self, bit_array: np.ndarray, writer: BitWriter|None = None) -> BitWriter:
+        """Return encoded message."""
+        if writer is None:
+            writer = BitWriter()
+        lane_length, active_lanes = self._lane_shape(bit_array.size)
+        lanes = np.zeros((self.lanes, lane_length), dtype=np.int8)
+        lanes.reshape(-1)[:bit_array.size] = bit_array
+        contexts = _lane_contexts(lanes, self.markov_order)
+        states = np.full(self.lanes, STATE_LOWER_BOUND, dtype=np.int64)
+        frequency_table = np.stack((self.zero_counts, PROBABILITY_SCALE - self.zero_counts))
+        renormalization_factor = (STATE_LOWER_BOUND >> PROBABILITY_BITS) << WORD_BITS
+        words = []
+        for step in range(lane_length - 1, -1, -1):
+            active = active_lanes[step]
+            state = states[:active]
+            bits = lanes[:active, step]
+            context = contexts[:active, step]
+            frequencies = frequency_table[bits, context]
+            overflowing = np.flatnonzero(state >= renormalization_factor*frequencies)
+            if overflowing.size:
+                words.append(state[overflowing] & 0xFFFF)
+                state[overflowing] >>= WORD_BITS
+            state[:] = ((state // frequencies) << PROBABILITY_BITS) + state % frequencies + bits*frequency_table[0, context]
+        words = np.concatenate(words[::-1]) if words else np.zeros(0, dtype=np.int64)
+        writer.write_varint(self.lanes)
+        writer.write_varint(words.size)
+        writer.write_bytes(states.astype('>u4').tobytes())
+        writer.write_bytes(words.astype('>u2').tobytes())
+        self.padding_number = writer.pad()
+        return writer
+
+    def decode(self, bits: np.ndarray|BitReader, symbol_count: int|None = None) -> np.ndarray:
+        """
+        Return decoded message.
+
+        Decoding stops after symbol_count bits. If it is not given, it
+        is inferred from the occurrence counts.
+        """
+        if isinstance(bits, np.ndarray):
+            bits = BitReader.from_array(bits)
+        if symbol_count is None:
+            symbol_count = self.symbol_count
+        self.lanes = bits.read_varint()
+        word_count = bits.read_varint()
+        states = np.frombuffer(bits.read_bytes(4*self.lanes), dtype='>u4').astype(np.int64)
+        words = np.frombuffer(bits.read_bytes(2*word_count), dtype='>u2').astype(np.int64)
+        lane_length, active_lanes = self._lane_shape(symbol_count)
+        lanes = np.zeros((self.lanes, lane_length), dtype=np.int8)
+        contexts = np.zeros(self.lanes, dtype=np.int64)
+        frequency_table = np.stack((self.zero_counts, PROBABILITY_SCALE - self.zero_counts))
+        context_mask = (1 << self.markov_order) - 1
+        word_position = 0
+        for step in range(lane_length):
+            active = active_lanes[step]
+            state = states[:active]
+            context = contexts[:active]
+            zero_counts = frequency_table[0, context]
+            slots = state & (PROBABILITY_SCALE - 1)
+            decoded = (slots >= zero_counts).view(np.int8)
+            state[:] = frequency_table[decoded, context]*(state >> PROBABILITY_BITS) + slots - decoded*zero_counts
+            underflowing = np.flatnonzero(state < STATE_LOWER_BOUND)
+            if underflowing.size:
+                next_position = word_position + underflowing.size
+                state[underflowing] = (state[underflowing] << WORD_BITS) | words[word_position:next_position]
+                word_position = next_position
+            lanes[:active, step] = decoded
+            context[:] = ((context << 1) | decoded) & context_mask
+        return lanes.reshape(-1)[:symbol_count].copy()
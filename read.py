@@ -1,26 +1,43 @@
 from pathlib import Path
+from typing import BinaryIO, Iterator
 
 import numpy as np
 
 import converter as c
+from bitio import BitReader
 
 BYTE_SIZE = 8
 PADDING_CHUNK = 3
+ORDER_CHUNK = 5
 OCCURRENCE_CHUNK = 32
+READ_CHUNK = 2**20
+MAGIC = b'ACOD'
+VERSION = 1
+FLAG_ADAPTIVE = 0b1
+FLAG_BLOCKS = 0b10
+FLAG_BLOCK_MODELS = 0b100
+FLAG_BYTES = 0b1000
+FLAG_HASHED = 0b10000
+ENGINE_SHIFT = 5
+ENGINE_MASK = 0b11
+FLAG_FIXED = 0b10000000
+ENGINE_NAMES = ('arithmetic', 'range', 'rans')
+INDEX_POINTER_SIZE = 8
 
 
 def read_bits(file_path: Path) -> np.ndarray:
     """Read bytes from file and convert to array of bits."""
-    bit_string = list()
-    with open(file_path, 'rb') as file:
-        file_bytes = file.read()
-        for byte in file_bytes:
-            bit_string.append(f'{byte:08b}')
-    bit_string = ''.join(bit_string)
-    return c.bit_string_to_array(bit_string)
+    file_bytes = np.fromfile(file_path, dtype=np.uint8)
+    return np.unpackbits(file_bytes).view(np.int8)
 
 
-def separate_encoded_message(bits: np.ndarray|str) -> tuple:
+def read_bit_chunks(file: BinaryIO, chunk_size: int = READ_CHUNK) -> Iterator[np.ndarray]:
+    """Read chunk_size bytes at a time from file as arrays of bits."""
+    while file_bytes := file.read(chunk_size):
+        yield np.unpackbits(np.frombuffer(file_bytes, dtype=np.uint8)).view(np.int8)
+
+
+def separate_encoded_message(bits: bytes|np.ndarray|str) -> tuple:
     """
     Get order, orccurrence dictionary and encoded message.
     
@@ -32,17 +49,83 @@ def separate_encoded_message(bits: np.ndarray|str) -> tuple:
     """
     if isinstance(bits, str):
         bits = c.bit_string_to_array(bits)
-    padding_number = c.bit_array_to_int(bits[0:PADDING_CHUNK])
-    markov_order = c.bit_array_to_int(bits[PADDING_CHUNK:BYTE_SIZE])
+    if isinstance(bits, np.ndarray):
+        reader = BitReader.from_array(bits)
+    else:
+        reader = BitReader(bits)
+    padding_number = reader.read_int(PADDING_CHUNK)
+    markov_order = reader.read_int(ORDER_CHUNK)
     occurrence_dict = dict()
     for i in range(2**(markov_order+1)):
-        start_index = OCCURRENCE_CHUNK*i+BYTE_SIZE
-        end_index = OCCURRENCE_CHUNK*(i+1)+BYTE_SIZE
-        occurrence_bytes = bits[start_index:end_index]
         occurrence = f'{i:0{markov_order+1}b}'
-        occurrence_dict[occurrence] = c.bit_array_to_int(occurrence_bytes)
-    if padding_number:
-        encoded_message = bits[end_index:-padding_number]
-    else:
-        encoded_message = bits[end_index:]
+        occurrence_dict[occurrence] = reader.read_int(OCCURRENCE_CHUNK)
+    encoded_message = reader.read_array(reader.remaining - padding_number)
     return markov_order, occurrence_dict, encoded_message
+
+
+def read_count_pairs(reader: BitReader) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Read the windows that occurred and how many times they did.
+
+    The table holds how many windows occurred, then, for each one, the
+    gap from the code of the previous one and the amount of times it
+    occurred, all as varints.
+    """
+    pair_count = reader.read_varint()
+    codes = np.empty(pair_count, dtype=np.int64)
+    occurrences = np.empty(pair_count, dtype=np.int64)
+    code = -1
+    for i in range(pair_count):
+        code += reader.read_varint() + 1
+        codes[i] = code
+        occurrences[i] = reader.read_varint()
+    return codes, occurrences
+
+
+def read_count_table(reader: BitReader, markov_order: int) -> np.ndarray:
+    """Read the occurrence counts of a container."""
+    counts = np.ones(2**(markov_order+1), dtype=np.int64)
+    codes, occurrences = read_count_pairs(reader)
+    counts[codes] += occurrences
+    return counts
+
+
+def engine_name(flags: int) -> str:
+    """Return the name of the engine that encoded a container."""
+    return ENGINE_NAMES[(flags >> ENGINE_SHIFT) & ENGINE_MASK]
+
+
+def separate_container(data: bytes) -> tuple:
+    """
+    Get flags, order, occurrence counts, amount of bits and a reader.
+
+    The reader is left at the start of the encoded message. For
+    adaptive containers there are no occurrence counts, and the amount
+    of bits is given by each segment instead of the header, so both are
+    None, and if their model is hashed the reader is left at the byte
+    with the bits of its table. For block containers the amount of bits
+    is given by the block index, and the occurrence counts are only in
+    the header if they are shared by every block. For byte containers
+    the occurrence counts are the pairs of codes and occurrences read by
+    read_count_pairs, and the amount given is of bytes. For fixed
+    precision containers the reader is left at the byte with the
+    precision.
+    """
+    reader = BitReader(data)
+    if reader.read_bytes(len(MAGIC)) != MAGIC:
+        raise ValueError('Data is not an encoded container.')
+    version = reader.read_int(BYTE_SIZE)
+    if version != VERSION:
+        raise ValueError(f'Unsupported container version {version}.')
+    flags = reader.read_int(BYTE_SIZE)
+    markov_order = reader.read_int(BYTE_SIZE)
+    if flags & FLAG_ADAPTIVE:
+        return flags, markov_order, None, None, reader
+    if flags & FLAG_BLOCKS:
+        counts = None if flags & FLAG_BLOCK_MODELS else read_count_table(reader, markov_order)
+        return flags, markov_order, counts, None, reader
+    symbol_count = reader.read_varint()
+    if flags & FLAG_BYTES:
+        return flags, markov_order, read_count_pairs(reader), symbol_count, reader
+    counts = read_count_table(reader, markov_order)
+    return flags, markov_order, counts, symbol_count, reader
@@ -1,21 +1,325 @@
-from json import dumps
+import gc
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from json import dumps, loads
 from pathlib import Path
+from typing import Callable
 
-from encode import encoded_bytes
+import numpy as np
+
+import read as r
+from adaptive import AdaptiveMBitLimits
+from bitio import BitWriter
+from decode import decoded_bits
+from encode import ENGINES, write_container_header, engine_flags
+from mbitlimits import MBitLimits
+from occurrences import (counts_from_occurrence_dict, occurrence_counts, occurrence_dict_from_counts,
+                         occurrence_dict_from_sequence)
+from unused_functions import generate_sequence
+
+BASELINE_PATH = Path(r'relas.json')
+CORPUS = tuple(sorted(Path('.').glob('modelo*.dat')))
+ORDERS = (0, 1, 2, 3)
+REFERENCE_ENGINE = 'reference'
+ADAPTIVE_ENGINE = 'adaptive'
+BENCHMARK_ENGINES = (REFERENCE_ENGINE, *ENGINES, ADAPTIVE_ENGINE)
+GENERATED_SIZE = 12500
+GENERATED_SKEWS = (0.5, 0.9)
+TOLERANCE = 0.1
+REPEATS = 5
+MIN_TOTAL_SECONDS = 0.2
+MIN_PHASE_SECONDS = 1e-3
+
+
+def _best_time(function: Callable) -> tuple:
+    """
+    Return the result of function and the least time it took to run.
+
+    As with timeit, garbage collection is off while function runs again
+    and again, until the runs add up to MIN_TOTAL_SECONDS, and only the
+    fastest run counts, since the slower ones were held back by
+    something else.
+    """
+    total = 0.0
+    best = float('inf')
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        while total < MIN_TOTAL_SECONDS:
+            start = time.perf_counter()
+            result = function()
+            seconds = time.perf_counter() - start
+            total += seconds
+            best = min(best, seconds)
+    finally:
+        if collecting:
+            gc.enable()
+    return result, best
+
+
+def _throughput(byte_count: int, seconds: float) -> float|None:
+    """Return megabytes per second, or None for a phase too short to time reliably."""
+    return byte_count/seconds/1e6 if seconds >= MIN_PHASE_SECONDS else None
+
+
+def _measure(function: Callable, byte_count: int, memory: bool = True) -> tuple:
+    """
+    Run function and return its result and how it performed.
+
+    Time and throughput come from the best of plain runs, taken by
+    _best_time, and benchmark keeps the best of several rounds. Phases that take less than MIN_PHASE_SECONDS even so
+    have no throughput, and are left out of comparisons. If memory is
+    measured, function runs again under tracemalloc, so the tracing
+    doesn't slow down the timed runs.
+    """
+    result, seconds = _best_time(function)
+    peak_traced = None
+    if memory:
+        tracemalloc.start()
+        function()
+        _, peak_traced = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, {
+        'seconds': seconds,
+        'mb_per_second': _throughput(byte_count, seconds),
+        'slowest_seconds': seconds,
+        'slowest_mb_per_second': _throughput(byte_count, seconds),
+        'peak_traced_bytes': peak_traced,
+    }
+
+
+def _combined(first: dict, second: dict, byte_count: int) -> dict:
+    """Return the measures of two runs taken as a single phase."""
+    seconds = first['seconds'] + second['seconds']
+    slowest_seconds = first['slowest_seconds'] + second['slowest_seconds']
+    peaks = [peak for peak in (first['peak_traced_bytes'], second['peak_traced_bytes']) if peak is not None]
+    return {
+        'seconds': seconds,
+        'mb_per_second': _throughput(byte_count, seconds),
+        'slowest_seconds': slowest_seconds,
+        'slowest_mb_per_second': _throughput(byte_count, slowest_seconds),
+        'peak_traced_bytes': max(peaks, default=None),
+    }
+
+
+def _model(engine: str, bit_array: np.ndarray, markov_order: int) -> np.ndarray|dict[str, int]|None:
+    """Build the static model an engine codes with, if it has one."""
+    if engine == ADAPTIVE_ENGINE:
+        return None
+    if engine == REFERENCE_ENGINE:
+        return occurrence_dict_from_sequence(bit_array, markov_order)
+    return occurrence_counts(bit_array, markov_order)
+
+
+def _encode(engine: str, bit_array: np.ndarray, markov_order: int,
+            model: np.ndarray|dict[str, int]|None) -> tuple[bytes, int]:
+    """
+    Return the container encoded by an engine and its header size in bytes.
+
+    The reference engine writes the same container as the arithmetic
+    engine, with MBitLimits in place of FastMBitLimits.
+    """
+    writer = BitWriter()
+    if engine == ADAPTIVE_ENGINE:
+        write_container_header(writer, markov_order, r.FLAG_ADAPTIVE)
+        header_size = len(writer) // r.BYTE_SIZE
+        writer.write_varint(bit_array.size)
+        AdaptiveMBitLimits(markov_order).encode(bit_array, writer)
+        writer.write_varint(0)
+        return writer.to_bytes(), header_size
+    if engine == REFERENCE_ENGINE:
+        counts = counts_from_occurrence_dict(model, markov_order)
+        write_container_header(writer, markov_order, 0, bit_array.size, counts)
+        header_size = len(writer) // r.BYTE_SIZE
+        MBitLimits(markov_order, model).encode(bit_array, writer)
+        return writer.to_bytes(), header_size
+    write_container_header(writer, markov_order, engine_flags(engine), bit_array.size, model)
+    header_size = len(writer) // r.BYTE_SIZE
+    ENGINES[engine](markov_order, model).encode(bit_array, writer)
+    return writer.to_bytes(), header_size
+
+
+def _decode(engine: str, encoded: bytes) -> np.ndarray:
+    """Return the bits of a container encoded by _encode."""
+    if engine != REFERENCE_ENGINE:
+        return decoded_bits(encoded)
+    _, markov_order, counts, symbol_count, reader = r.separate_container(encoded)
+    return MBitLimits(markov_order, occurrence_dict_from_counts(counts, markov_order)).decode(reader, symbol_count)
+
+
+def benchmark_input(data: bytes, engines: tuple[str, ...] = BENCHMARK_ENGINES, orders: tuple[int, ...] = ORDERS,
+                    memory: bool = True) -> dict[str, dict[str, dict]]:
+    """
+    Benchmark every engine and order on some data.
+
+    Returns, for every engine and order, the size of the container and
+    of its header, the bits per symbol, whether the data decoded back,
+    and the time, throughput and memory of each phase: conversion of
+    bytes to bits and back, model building, encoding and decoding.
+    Throughput is always in megabytes of the original data per second.
+    """
+    results = dict()
+    byte_count = len(data)
+    bit_array, conversion = _measure(lambda: np.unpackbits(np.frombuffer(data, dtype=np.uint8)).view(np.int8),
+                                     byte_count, memory)
+    for engine in engines:
+        results[engine] = dict()
+        for markov_order in orders:
+            model, model_phase = _measure(lambda: _model(engine, bit_array, markov_order), byte_count, memory)
+            (encoded, header_size), encode_phase = _measure(lambda: _encode(engine, bit_array, markov_order, model),
+                                                            byte_count, memory)
+            decoded, decode_phase = _measure(lambda: _decode(engine, encoded), byte_count, memory)
+            _, reconversion = _measure(lambda: np.packbits(decoded.view(np.uint8)).tobytes(), byte_count, memory)
+            results[engine][str(markov_order)] = {
+                'encoded_bytes': len(encoded),
+                'header_bytes': header_size,
+                'header_overhead': header_size/len(encoded),
+                'bits_per_symbol': r.BYTE_SIZE*len(encoded)/bit_array.size if bit_array.size else None,
+                'round_trip': bool(np.array_equal(decoded, bit_array)),
+                'phases': {
+                    'conversion': _combined(conversion, reconversion, byte_count),
+                    'model': model_phase,
+                    'encode': encode_phase,
+                    'decode': decode_phase,
+                },
+            }
+    return results
+
+
+def _keep_best(results: dict, other: dict) -> None:
+    """
+    Keep in results the time of every phase that ran faster in other,
+    and the time of every phase whose slowest round is the one of other.
+    """
+    for engine, orders in results.items():
+        for markov_order, result in orders.items():
+            for phase, measures in result['phases'].items():
+                other_measures = other[engine][markov_order]['phases'][phase]
+                if other_measures['seconds'] < measures['seconds']:
+                    measures['seconds'] = other_measures['seconds']
+                    measures['mb_per_second'] = other_measures['mb_per_second']
+                if other_measures['seconds'] > measures['slowest_seconds']:
+                    measures['slowest_seconds'] = other_measures['seconds']
+                    measures['slowest_mb_per_second'] = other_measures['mb_per_second']
+
+
+def benchmark(inputs: dict[str, bytes], engines: tuple[str, ...] = BENCHMARK_ENGINES,
+              orders: tuple[int, ...] = ORDERS, memory: bool = True, repeats: int = REPEATS) -> dict:
+    """
+    Benchmark every input with benchmark_input, keeping the best time of
+    every phase over repeats rounds.
+
+    Every round goes through all of the inputs, so the runs of a phase
+    are spread over the whole benchmark, and a spell in which the
+    machine is slower can't hold all of them back. The time of the
+    slowest round is kept as well, since how far it is from the best one
+    shows how noisy the machine is. Memory is only traced in the first
+    round.
+    """
+    results = {name: benchmark_input(data, engines, orders, memory) for name, data in inputs.items()}
+    for _ in range(repeats - 1):
+        for name, data in inputs.items():
+            _keep_best(results[name], benchmark_input(data, engines, orders, False))
+    return results
+
+
+def corpus(files: tuple[Path, ...] = CORPUS, size: int = GENERATED_SIZE, skews: tuple[float, ...] = GENERATED_SKEWS,
+           seed: int = 0) -> dict[str, bytes]:
+    """
+    Return the data of every benchmark input by name.
+
+    Besides the files, there is a generated input of size bytes for every
+    skew, which is the probability of a bit being zero, made with
+    generate_sequence from a fixed seed.
+    """
+    inputs = {path.name: path.read_bytes() for path in files}
+    for skew in skews:
+        np.random.seed(seed)
+        bit_array = generate_sequence(r.BYTE_SIZE*size, skew)
+        inputs[f'generated-{size}-{skew}'] = np.packbits(bit_array.view(np.uint8)).tobytes()
+    return inputs
+
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> list[str]:
+    """
+    Return the regressions of results against a baseline.
+
+    A regression is a run that no longer decodes back, a larger encoded
+    size, a phase whose traced memory grew by more than tolerance, or a
+    phase whose best throughput fell by more than tolerance below the
+    one of the slowest round of the baseline, so that only drops that
+    stand out of the noise between rounds count. Runs missing from
+    either side are skipped, and so are throughputs of phases too short
+    to time on either side.
+    """
+    regressions = []
+    for name, engines in baseline.items():
+        for engine, orders in engines.items():
+            for markov_order, old in orders.items():
+                new = results.get(name, {}).get(engine, {}).get(markov_order)
+                if new is None:
+                    continue
+                run = f'{name} {engine} order {markov_order}'
+                if not new['round_trip']:
+                    regressions.append(f'{run}: does not decode back')
+                if new['encoded_bytes'] > old['encoded_bytes']:
+                    regressions.append(f'{run}: {old["encoded_bytes"]} -> {new["encoded_bytes"]} encoded bytes')
+                for phase, old_phase in old['phases'].items():
+                    new_phase = new['phases'][phase]
+                    old_throughput = old_phase.get('slowest_mb_per_second', old_phase['mb_per_second'])
+                    if old_throughput and new_phase['mb_per_second'] \
+                            and new_phase['mb_per_second'] < old_throughput*(1 - tolerance):
+                        regressions.append(f'{run}, {phase}: {old_phase["mb_per_second"]:.3f} '
+                                           f'(slowest round {old_throughput:.3f}) -> '
+                                           f'{new_phase["mb_per_second"]:.3f} MB/s')
+                    if old_phase['peak_traced_bytes'] and new_phase['peak_traced_bytes'] \
+                            and new_phase['peak_traced_bytes'] > old_phase['peak_traced_bytes']*(1 + tolerance):
+                        regressions.append(f'{run}, {phase}: {old_phase["peak_traced_bytes"]} -> '
+                                           f'{new_phase["peak_traced_bytes"]} traced bytes')
+    return regressions
+
+
+def _report(results: dict) -> None:
+    """Print a line per run with its ratio and the throughput of each phase."""
+    for name, engines in results.items():
+        for engine, orders in engines.items():
+            for markov_order, result in orders.items():
+                throughputs = ', '.join(f'{phase} {measures["mb_per_second"] or 0:.3f}'
+                                        for phase, measures in result['phases'].items())
+                print(f'{name} {engine} order {markov_order}: {result["bits_per_symbol"] or 0:.4f} bits/symbol, '
+                      f'header {result["header_bytes"]}/{result["encoded_bytes"]} bytes, MB/s {throughputs}')
 
 
 def main():
-    how_compressed = dict()
-    for i in range(1, 5):
-        file_string = f'modelo{i}.dat'
-        data_path = Path(file_string)
-        how_compressed[file_string] = dict()
-        for order in range(4):
-            how_compressed[file_string][order] = len(encoded_bytes(order, data_path))*8
-    print(how_compressed)
-    with open(r'relas.json', 'w') as file:
-        file.write(dumps(how_compressed))
+    parser = ArgumentParser(description='Benchmark encoding and decoding over a corpus.')
+    parser.add_argument('files', nargs='*', type=Path, default=CORPUS)
+    parser.add_argument('--engines', nargs='+', choices=BENCHMARK_ENGINES, default=BENCHMARK_ENGINES)
+    parser.add_argument('--orders', nargs='+', type=int, default=ORDERS)
+    parser.add_argument('--size', type=int, default=GENERATED_SIZE, help='bytes of each generated input')
+    parser.add_argument('--skews', nargs='*', type=float, default=GENERATED_SKEWS,
+                        help='probability of zero of each generated input')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=REPEATS, help='rounds to take the best time of each phase from')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc runs')
+    parser.add_argument('--output', type=Path, default=BASELINE_PATH)
+    parser.add_argument('--compare', type=Path, help='baseline to flag regressions against')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    arguments = parser.parse_args()
+    baseline = loads(arguments.compare.read_text()) if arguments.compare else None
+    inputs = corpus(tuple(arguments.files), arguments.size, tuple(arguments.skews), arguments.seed)
+    results = benchmark(inputs, tuple(arguments.engines), tuple(arguments.orders), not arguments.no_memory,
+                        arguments.repeats)
+    _report(results)
+    with open(arguments.output, 'w') as file:
+        file.write(dumps(results, indent=4))
+    if baseline is not None:
+        regressions = compare(results, baseline, arguments.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            raise SystemExit(1)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
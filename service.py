@@ -0,0 +1,392 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from argparse import ArgumentParser
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+import read as r
+from bitio import BitWriter
+from decode import decoded_bits
+from encode import write_container_header
+from hotlimits import HotMBitLimits
+from occurrences import occurrence_counts
+
+HOST = '127.0.0.1'
+PORT = 8437
+LENGTH_SIZE = 4
+REQUEST_ID_SIZE = 4
+MAX_FRAME_SIZE = 2**30
+QUEUE_SIZE = 256
+COUNT_CACHE_SIZE = 128
+LATENCY_WINDOW = 4096
+MAX_ORDER = 20
+ORDER_OFFSET = len(r.MAGIC) + 2
+POOL_RETRIES = 1
+OPERATION_ENCODE = ord('E')
+OPERATION_DECODE = ord('D')
+OPERATION_STATS = ord('S')
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+
+def _encode_job(data: bytes, markov_order: int, counts: np.ndarray|None) -> tuple[bytes, np.ndarray]:
+    """
+    Encode data into a static container, in a worker process.
+
+    The counts are only built if they are not given, and are returned
+    so the server can keep them for the next time the data comes in.
+    """
+    bit_array = np.unpackbits(np.frombuffer(data, dtype=np.uint8)).view(np.int8)
+    if counts is None:
+        counts = occurrence_counts(bit_array, markov_order)
+    writer = BitWriter()
+    write_container_header(writer, markov_order, 0, bit_array.size, counts)
+    HotMBitLimits(markov_order, counts).encode(bit_array, writer)
+    return writer.to_bytes(), counts
+
+
+def _decode_job(encoded: bytes) -> bytes:
+    """Decode a container, in a worker process."""
+    return np.packbits(decoded_bits(encoded).view(np.uint8)).tobytes()
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> bytes|None:
+    """Return the next frame, or None once the other end is done."""
+    try:
+        length = int.from_bytes(await reader.readexactly(LENGTH_SIZE), 'big')
+        if length > MAX_FRAME_SIZE:
+            raise ValueError(f'Frame of {length} bytes is too large.')
+        return await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def _frame(payload: bytes) -> bytes:
+    return len(payload).to_bytes(LENGTH_SIZE, 'big') + payload
+
+
+def _check_request(operation: int, payload: bytes) -> None:
+    """
+    Raise ValueError if a request can't be run.
+
+    The order, given by the client or in the header of the container,
+    is checked before the job is queued, since the count table of an
+    order takes 2^(order + 1) counts in the worker.
+    """
+    if operation == OPERATION_ENCODE:
+        if not payload:
+            raise ValueError('Encode requests start with an order byte.')
+        markov_order = payload[0]
+    elif operation == OPERATION_DECODE:
+        if len(payload) <= ORDER_OFFSET:
+            raise ValueError('Data is not an encoded container.')
+        markov_order = payload[ORDER_OFFSET]
+    else:
+        raise ValueError(f'Unknown operation {operation}.')
+    if markov_order > MAX_ORDER:
+        raise ValueError(f'Orders are limited to {MAX_ORDER}, not {markov_order}.')
+
+
+class CompressionServer:
+    """
+    Serve encode and decode jobs over length-prefixed frames.
+
+    A request frame is a request ID, in REQUEST_ID_SIZE bytes, an
+    operation byte and, for encoding, an order byte, followed by the
+    data. The response frame is the same request ID, a status byte and
+    either the result or an error message. Responses are sent as soon
+    as their job is done, so a client can have many requests in flight
+    on a connection and a slow one doesn't hold back the others.
+    Requests with orders over MAX_ORDER are refused before they are
+    queued.
+
+    Jobs wait in a bounded queue for a fixed amount of workers, each
+    handing one job at a time to the process pool. When the queue is
+    full, a connection stops reading frames until there is room, which
+    pushes back on the client through the socket. If a worker process
+    dies, the pool is replaced and the jobs it had are run again, up to
+    POOL_RETRIES times, so one crash doesn't take the server down. The
+    count tables of the most recently encoded data are kept in memory,
+    keyed by content hash and order, so data that comes in again is not
+    recounted.
+    """
+    jobs: int
+    queue: asyncio.Queue
+    count_cache: OrderedDict
+    count_cache_size: int
+    latencies: deque
+    completed: int
+    failed: int
+    pool_restarts: int
+    executor: ProcessPoolExecutor|None
+    workers: list[asyncio.Task]
+
+    def __init__(self, jobs: int|None = None, queue_size: int = QUEUE_SIZE,
+                 count_cache_size: int = COUNT_CACHE_SIZE) -> None:
+        self.jobs = jobs or os.cpu_count() or 1
+        self.queue = asyncio.Queue(queue_size)
+        self.count_cache = OrderedDict()
+        self.count_cache_size = count_cache_size
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.completed = 0
+        self.failed = 0
+        self.pool_restarts = 0
+        self.executor = None
+        self.workers = []
+
+    def _cached_counts(self, key: tuple[bytes, int]) -> np.ndarray|None:
+        counts = self.count_cache.get(key)
+        if counts is not None:
+            self.count_cache.move_to_end(key)
+        return counts
+
+    def _cache_counts(self, key: tuple[bytes, int], counts: np.ndarray) -> None:
+        self.count_cache[key] = counts
+        self.count_cache.move_to_end(key)
+        while len(self.count_cache) > self.count_cache_size:
+            self.count_cache.popitem(last=False)
+
+    async def _submit(self, function, *arguments):
+        """
+        Run a function in the process pool and return its result.
+
+        If the pool breaks because a worker died, it is replaced, unless
+        another job already did, and the function is run again.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(POOL_RETRIES + 1):
+            executor = self.executor
+            try:
+                return await loop.run_in_executor(executor, function, *arguments)
+            except BrokenProcessPool:
+                if self.executor is executor:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self.executor = ProcessPoolExecutor(self.jobs)
+                    self.pool_restarts += 1
+                if attempt == POOL_RETRIES:
+                    raise RuntimeError('The worker process running the job died.') from None
+
+    async def _run(self, operation: int, payload: bytes) -> bytes:
+        """Run a job in the process pool and return its result."""
+        _check_request(operation, payload)
+        if operation == OPERATION_DECODE:
+            return await self._submit(_decode_job, payload)
+        markov_order, data = payload[0], payload[1:]
+        key = (hashlib.blake2b(data, digest_size=16).digest(), markov_order)
+        encoded, counts = await self._submit(_encode_job, data, markov_order, self._cached_counts(key))
+        self._cache_counts(key, counts)
+        return encoded
+
+    async def _worker(self) -> None:
+        """Take jobs from the queue and hand them to the process pool, one at a time."""
+        while True:
+            operation, payload, future = await self.queue.get()
+            try:
+                future.set_result(await self._run(operation, payload))
+            except Exception as error:
+                if not future.done():
+                    future.set_exception(error)
+            finally:
+                self.queue.task_done()
+
+    def stats(self) -> dict[str, int|float]:
+        """Return the queue depth, the job counts and the latency percentiles, in milliseconds."""
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        p50, p90, p99 = (1000*np.percentile(latencies, (50, 90, 99))).tolist()
+        return {
+            'queue_depth': self.queue.qsize(),
+            'queue_size': self.queue.maxsize,
+            'workers': self.jobs,
+            'completed': self.completed,
+            'failed': self.failed,
+            'pool_restarts': self.pool_restarts,
+            'cached_count_tables': len(self.count_cache),
+            'latency_p50_ms': p50,
+            'latency_p90_ms': p90,
+            'latency_p99_ms': p99,
+        }
+
+    async def _respond(self, writer: asyncio.StreamWriter, request_id: bytes, future: asyncio.Future,
+                       start: float) -> None:
+        """Send the response to a request once its job is done."""
+        try:
+            response = request_id + bytes((STATUS_OK,)) + await future
+            self.completed += 1
+        except Exception as error:
+            response = request_id + bytes((STATUS_ERROR,)) + str(error).encode()
+            self.failed += 1
+        self.latencies.append(time.perf_counter() - start)
+        writer.write(_frame(response))
+        await writer.drain()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve the requests of a connection until it closes."""
+        responses = set()
+        try:
+            while (frame := await _read_frame(reader)) is not None:
+                start = time.perf_counter()
+                request_id = frame[:REQUEST_ID_SIZE].ljust(REQUEST_ID_SIZE, b'\0')
+                future = asyncio.get_running_loop().create_future()
+                if len(frame) <= REQUEST_ID_SIZE:
+                    future.set_exception(ValueError(f'Frame of {len(frame)} bytes has no operation.'))
+                elif frame[REQUEST_ID_SIZE] == OPERATION_STATS:
+                    future.set_result(json.dumps(self.stats()).encode())
+                else:
+                    operation, payload = frame[REQUEST_ID_SIZE], frame[REQUEST_ID_SIZE+1:]
+                    try:
+                        _check_request(operation, payload)
+                    except ValueError as error:
+                        future.set_exception(error)
+                    else:
+                        await self.queue.put((operation, payload, future))
+                response = asyncio.create_task(self._respond(writer, request_id, future, start))
+                responses.add(response)
+                response.add_done_callback(responses.discard)
+            if responses:
+                await asyncio.gather(*responses, return_exceptions=True)
+        finally:
+            writer.close()
+
+    async def start(self, host: str = HOST, port: int = PORT, path: str|None = None) -> asyncio.AbstractServer:
+        """Start the workers and listen on a TCP port, or on a Unix socket if a path is given."""
+        self.executor = ProcessPoolExecutor(self.jobs)
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.jobs)]
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle, path)
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self) -> None:
+        """Stop the workers and the process pool."""
+        for worker in self.workers:
+            worker.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+
+class CompressionClient:
+    """
+    Send requests to a CompressionServer over a single connection.
+
+    Requests are given increasing IDs and can be awaited concurrently:
+    a background task reads the responses as they arrive and resolves
+    the request they answer, whatever the order.
+    """
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+    pending: dict[int, asyncio.Future]
+    next_id: int
+    receiver: asyncio.Task
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.pending = dict()
+        self.next_id = 0
+        self.receiver = asyncio.create_task(self._receive())
+
+    @classmethod
+    async def connect(cls, host: str = HOST, port: int = PORT, path: str|None = None) -> 'CompressionClient':
+        if path is not None:
+            return cls(*await asyncio.open_unix_connection(path))
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def _receive(self) -> None:
+        try:
+            while (frame := await _read_frame(self.reader)) is not None:
+                future = self.pending.pop(int.from_bytes(frame[:REQUEST_ID_SIZE], 'big'))
+                if frame[REQUEST_ID_SIZE] == STATUS_OK:
+                    future.set_result(frame[REQUEST_ID_SIZE+1:])
+                else:
+                    future.set_exception(RuntimeError(frame[REQUEST_ID_SIZE+1:].decode()))
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('Connection to the server was closed.'))
+
+    async def request(self, operation: int, payload: bytes = b'') -> bytes:
+        """Send a request and return the result."""
+        request_id = self.next_id
+        self.next_id = (self.next_id + 1) % 2**(8*REQUEST_ID_SIZE)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.writer.write(_frame(request_id.to_bytes(REQUEST_ID_SIZE, 'big') + bytes((operation,)) + payload))
+        await self.writer.drain()
+        return await future
+
+    async def encode(self, data: bytes, markov_order: int = 0) -> bytes:
+        return await self.request(OPERATION_ENCODE, bytes((markov_order,)) + data)
+
+    async def decode(self, encoded: bytes) -> bytes:
+        return await self.request(OPERATION_DECODE, encoded)
+
+    async def stats(self) -> dict[str, int|float]:
+        return json.loads(await self.request(OPERATION_STATS))
+
+    async def close(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.receiver.cancel()
+
+
+async def _serve(arguments) -> None:
+    server = CompressionServer(arguments.jobs, arguments.queue_size)
+    listener = await server.start(arguments.host, arguments.port, arguments.path)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+
+
+async def _bench(arguments) -> None:
+    """Send many small requests at once and check every one decodes back."""
+    data = np.fromfile(arguments.file, dtype=np.uint8).tobytes()
+    records = [data[i:i+arguments.record_size] for i in range(0, len(data), arguments.record_size)]
+    clients = [await CompressionClient.connect(arguments.host, arguments.port, arguments.path)
+               for _ in range(arguments.connections)]
+    semaphore = asyncio.Semaphore(arguments.concurrency)
+
+    async def round_trip(number: int) -> bool:
+        async with semaphore:
+            client = clients[number % len(clients)]
+            record = records[number % len(records)]
+            encoded = await client.encode(record, arguments.order)
+            return await client.decode(encoded) == record
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(round_trip(number) for number in range(arguments.requests)))
+    seconds = time.perf_counter() - start
+    print(f'{arguments.requests} round trips in {seconds:.2f} s, {sum(results)} decoded back')
+    print(json.dumps(await clients[0].stats(), indent=4))
+    for client in clients:
+        await client.close()
+
+
+def main():
+    parser = ArgumentParser(description='Serve encoding and decoding over a socket.')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--path', help='Unix socket to use instead of TCP')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='run the server')
+    serve.add_argument('-j', '--jobs', type=int, help='worker processes, one per CPU by default')
+    serve.add_argument('--queue-size', type=int, default=QUEUE_SIZE)
+    bench = commands.add_parser('bench', help='load a running server with small requests')
+    bench.add_argument('file', help='data to cut into records')
+    bench.add_argument('--record-size', type=int, default=256)
+    bench.add_argument('--requests', type=int, default=1000)
+    bench.add_argument('--concurrency', type=int, default=64)
+    bench.add_argument('--connections', type=int, default=4)
+    bench.add_argument('--order', type=int, default=2)
+    arguments = parser.parse_args()
+    asyncio.run(_serve(arguments) if arguments.command == 'serve' else _bench(arguments))
+
+
+if __name__ == '__main__':
+    main()
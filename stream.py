@@ -0,0 +1,463 @@
+from typing import BinaryIO, Callable
+
+import numpy as np
+
+import read as r
+from bitio import BitReader, BitWriter
+from adaptive import AdaptiveMBitLimits, decode_segments
+from encode import write_container_header
+from hashedmodel import HashedAdaptiveMBitLimits, table_bits_for_budget
+from hotlimits import HotMBitLimits
+from occurrences import counts_from_occurrence_dict, occurrence_counts_from_chunks, sequence_length
+
+SEGMENT_SIZE = 2**20
+STATE_MAGIC = b'ACST'
+STATE_OFFSET_SIZE = 8
+HEADER_SIZE = 16
+DECODE_CHUNK = 2**16
+CHECKPOINT_INTERVAL = 16
+
+
+class StreamEncoder:
+    """
+    Encode bytes written to it and pass the result on to a sink.
+
+    Works as a writable binary file: whatever is written is encoded
+    with the given occurrence counts, and the complete bytes produced by
+    the mappings are written to the sink right away, so memory use does
+    not depend on how much is encoded. The container header goes out
+    first, so the amount of bits to encode has to be known in advance.
+    If it is not given, it is inferred from the occurrence counts.
+    """
+    sink: BinaryIO
+    counts: np.ndarray
+    limits: HotMBitLimits
+    writer: BitWriter
+    symbol_count: int
+    written_count: int
+    closed: bool
+
+    def __init__(self, sink: BinaryIO, markov_order: int, occurrences: dict[str, int]|np.ndarray,
+                 symbol_count: int|None = None) -> None:
+        if isinstance(occurrences, dict):
+            occurrences = counts_from_occurrence_dict(occurrences, markov_order)
+        if symbol_count is None:
+            symbol_count = sequence_length(occurrences, markov_order)
+        self.sink = sink
+        self.counts = occurrences
+        self.limits = HotMBitLimits(markov_order, occurrences)
+        self.writer = BitWriter()
+        self.symbol_count = symbol_count
+        self.written_count = 0
+        self.closed = False
+        write_container_header(self.writer, markov_order, symbol_count=symbol_count, counts=occurrences)
+        self._drain()
+
+    def __enter__(self) -> 'StreamEncoder':
+        return self
+
+    def __exit__(self, *exception_info) -> None:
+        self.close()
+
+    def _drain(self) -> None:
+        """Write the complete bytes encoded so far to the sink."""
+        complete_bytes = self.writer.drain()
+        if complete_bytes:
+            self.sink.write(complete_bytes)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        """Encode the bits of data and return how many bytes were taken."""
+        if self.closed:
+            raise ValueError('I/O operation on closed encoder.')
+        data = memoryview(data).cast('B')
+        bit_array = np.unpackbits(np.frombuffer(data, dtype=np.uint8)).view(np.int8)
+        if self.written_count + bit_array.size > self.symbol_count:
+            raise ValueError('More bits written than the header announces.')
+        self.limits.encode_bits(bit_array, self.writer)
+        self.written_count += bit_array.size
+        self._drain()
+        return data.nbytes
+
+    def flush(self) -> None:
+        self.sink.flush()
+
+    def close(self) -> None:
+        """End the encoded message and flush."""
+        if self.closed:
+            return
+        self.limits.finish(self.writer)
+        self._drain()
+        self.closed = True
+        self.flush()
+        if self.written_count != self.symbol_count:
+            raise ValueError('Fewer bits written than the header announces.')
+
+
+def encode_stream(source: BinaryIO, sink: BinaryIO, markov_order: int, chunk_size: int = r.READ_CHUNK) -> None:
+    """
+    Encode a seekable binary stream into a sink a chunk at a time.
+
+    The source is read twice, once to count the occurrences and once to
+    encode it, so memory use only depends on the chunk size.
+    """
+    start_position = source.tell()
+    counts = occurrence_counts_from_chunks(r.read_bit_chunks(source, chunk_size), markov_order)
+    source.seek(start_position)
+    with StreamEncoder(sink, markov_order, counts) as encoder:
+        while chunk := source.read(chunk_size):
+            encoder.write(chunk)
+
+
+class AdaptiveStreamEncoder:
+    """
+    Encode bytes written to it with an adaptive model, in one pass.
+
+    Works as a writable binary file. Since the length of the message is
+    not known in advance, it is encoded in an adaptive container, in
+    segments of at most segment_size bytes: each segment starts with the
+    amount of bits it encodes, written as a varint, followed by its
+    encoded message, ended and padded to a whole byte. The counts and
+    the context carry on from one segment to the next, and an empty
+    segment marks the end of the stream. Only the bytes of the current
+    segment are held in memory, so the source can be a pipe. With a
+    memory budget the model is a HashedAdaptiveMBitLimits.
+
+    If keep_state is set, the empty segment is followed by the state of
+    the model, the offset of that state in the container, in
+    STATE_OFFSET_SIZE bytes, and STATE_MAGIC, so append_stream can
+    reopen the container and carry on encoding. Decoders stop at the
+    empty segment and never read the state. Given the limits of a
+    container that is being resumed, no header is written, and position
+    is where the sink starts in the container.
+    """
+    sink: BinaryIO
+    limits: AdaptiveMBitLimits
+    writer: BitWriter
+    segment: bytearray
+    segment_size: int
+    keep_state: bool
+    position: int
+    closed: bool
+
+    def __init__(self, sink: BinaryIO, markov_order: int, segment_size: int = SEGMENT_SIZE,
+                 memory_budget: int|None = None, keep_state: bool = False,
+                 limits: AdaptiveMBitLimits|None = None, position: int = 0) -> None:
+        self.sink = sink
+        self.writer = BitWriter()
+        self.segment = bytearray()
+        self.segment_size = segment_size
+        self.keep_state = keep_state
+        self.position = position
+        self.closed = False
+        if limits is not None:
+            self.limits = limits
+        elif memory_budget is None:
+            self.limits = AdaptiveMBitLimits(markov_order)
+            write_container_header(self.writer, markov_order, r.FLAG_ADAPTIVE)
+        else:
+            table_bits = table_bits_for_budget(memory_budget)
+            self.limits = HashedAdaptiveMBitLimits(markov_order, table_bits)
+            write_container_header(self.writer, markov_order, r.FLAG_ADAPTIVE | r.FLAG_HASHED)
+            self.writer.write_int(table_bits, r.BYTE_SIZE)
+
+    def __enter__(self) -> 'AdaptiveStreamEncoder':
+        return self
+
+    def __exit__(self, *exception_info) -> None:
+        self.close()
+
+    def _encode_segment(self, segment: bytes) -> None:
+        """Encode a segment and write it to the sink."""
+        bit_array = np.unpackbits(np.frombuffer(segment, dtype=np.uint8)).view(np.int8)
+        self.writer.write_varint(bit_array.size)
+        self.limits.restart()
+        self.limits.encode_bits(bit_array, self.writer)
+        self.limits.finish(self.writer)
+        self._write(self.writer.drain())
+
+    def _write(self, data: bytes) -> None:
+        self.sink.write(data)
+        self.position += len(data)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        """Encode data, a segment at a time, and return how many bytes were taken."""
+        if self.closed:
+            raise ValueError('I/O operation on closed encoder.')
+        data = memoryview(data).cast('B')
+        self.segment.extend(data)
+        while len(self.segment) >= self.segment_size:
+            self._encode_segment(self.segment[:self.segment_size])
+            del self.segment[:self.segment_size]
+        return data.nbytes
+
+    def flush(self) -> None:
+        self.sink.flush()
+
+    def close(self) -> None:
+        """Encode what is left, mark the end of the stream and flush."""
+        if self.closed:
+            return
+        if self.segment:
+            self._encode_segment(self.segment)
+            self.segment.clear()
+        self.writer.write_varint(0)
+        self._write(self.writer.drain())
+        if self.keep_state:
+            state_position = self.position
+            self._write(self.limits.state())
+            self._write(state_position.to_bytes(STATE_OFFSET_SIZE, 'big') + STATE_MAGIC)
+        self.closed = True
+        self.flush()
+
+
+def encode_adaptive_stream(source: BinaryIO, sink: BinaryIO, markov_order: int, segment_size: int = SEGMENT_SIZE,
+                           memory_budget: int|None = None, keep_state: bool = False) -> None:
+    """Encode a binary stream into a sink in a single pass."""
+    with AdaptiveStreamEncoder(sink, markov_order, segment_size, memory_budget, keep_state) as encoder:
+        while chunk := source.read(segment_size):
+            encoder.write(chunk)
+
+
+def _container_limits(data: bytes) -> tuple[AdaptiveMBitLimits, BitReader]:
+    """
+    Return new limits for the model of an adaptive container, and a
+    reader left at its first segment.
+    """
+    flags, markov_order, _, _, reader = r.separate_container(data)
+    if not flags & r.FLAG_ADAPTIVE:
+        raise ValueError('Only adaptive containers can be appended to.')
+    if flags & r.FLAG_HASHED:
+        return HashedAdaptiveMBitLimits(markov_order, reader.read_int(r.BYTE_SIZE)), reader
+    return AdaptiveMBitLimits(markov_order), reader
+
+
+def append_stream(file: BinaryIO, segment_size: int = SEGMENT_SIZE) -> AdaptiveStreamEncoder:
+    """
+    Reopen an adaptive container to encode more bytes at its end.
+
+    The file has to be opened for reading and writing. If the container
+    ends with a state, the model is restored from it, and the empty
+    segment and the state are cut off, so only the header and the end
+    of the container are read and appending takes time in proportion
+    to the new bytes. A container without a state is decoded once to
+    rebuild the model. Either way, the encoder keeps the state when it
+    is closed, so the next append is quick.
+    """
+    file.seek(0)
+    limits, _ = _container_limits(file.read(HEADER_SIZE))
+    footer_size = STATE_OFFSET_SIZE + len(STATE_MAGIC)
+    end = file.seek(0, 2)
+    file.seek(max(end - footer_size, 0))
+    footer = file.read(footer_size)
+    if footer.endswith(STATE_MAGIC):
+        state_position = int.from_bytes(footer[:STATE_OFFSET_SIZE], 'big')
+        file.seek(state_position)
+        limits.restore_state(file.read(end - footer_size - state_position))
+    else:
+        file.seek(0)
+        limits, reader = _container_limits(file.read())
+        decode_segments(reader, limits)
+        state_position = reader.position//r.BYTE_SIZE
+    position = state_position - 1
+    file.seek(position)
+    file.truncate()
+    return AdaptiveStreamEncoder(file, limits.markov_order, segment_size, keep_state=True, limits=limits,
+                                 position=position)
+
+
+class DecodeCheckpoint:
+    """
+    Where a StreamDecoder is in a container, so an interrupted decoding
+    can resume from it.
+
+    The input position is in bits from the start of the container and
+    the output position in bytes written to the sink. Along with them
+    go the tag, the limits, the context and the E_3 mapping counter of
+    the decoder. A checkpoint is serialized as a varint for each of
+    them, in that order.
+    """
+    input_position: int
+    output_position: int
+    tag: int
+    lower: int
+    upper: int
+    context: int
+    e_3_mapping_counter: int
+
+    def __init__(self, input_position: int, output_position: int, tag: int, lower: int, upper: int, context: int,
+                 e_3_mapping_counter: int = 0) -> None:
+        self.input_position = input_position
+        self.output_position = output_position
+        self.tag = tag
+        self.lower = lower
+        self.upper = upper
+        self.context = context
+        self.e_3_mapping_counter = e_3_mapping_counter
+
+    def __repr__(self) -> str:
+        return (f'DecodeCheckpoint(input_position={self.input_position}, output_position={self.output_position}, '
+                f'tag={self.tag}, lower={self.lower}, upper={self.upper}, context={self.context}, '
+                f'e_3_mapping_counter={self.e_3_mapping_counter})')
+
+    def _fields(self) -> tuple[int, ...]:
+        return (self.input_position, self.output_position, self.tag, self.lower, self.upper, self.context,
+                self.e_3_mapping_counter)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, DecodeCheckpoint):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def to_bytes(self) -> bytes:
+        """Return the checkpoint serialized."""
+        writer = BitWriter()
+        for value in self._fields():
+            writer.write_varint(value)
+        return writer.to_bytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'DecodeCheckpoint':
+        """Return a checkpoint serialized by to_bytes."""
+        reader = BitReader(data)
+        return cls(*(reader.read_varint() for _ in range(7)))
+
+
+class StreamDecoder:
+    """
+    Decode a static container read from a source, writing the decoded
+    bytes to a sink a chunk at a time.
+
+    Only the header, the model and the encoded bits of the chunk being
+    decoded are held in memory: before each chunk of chunk_size bytes,
+    the reader is refilled from the source with as many bits as the
+    chunk can take, which is at most a word per decoded bit, and the
+    bytes already read are dropped. The tag is read as soon as the
+    header is, so the decoder can be checkpointed between any two
+    chunks.
+
+    Given a checkpoint, the header is read again for the model, and
+    then the source, which has to be seekable, is moved to the input
+    position of the checkpoint. The sink is expected to be at its output
+    position already.
+    """
+    source: BinaryIO
+    sink: BinaryIO
+    limits: HotMBitLimits
+    reader: BitReader
+    offset: int
+    symbol_count: int
+    decoded_count: int
+    chunk_size: int
+
+    def __init__(self, source: BinaryIO, sink: BinaryIO, chunk_size: int = DECODE_CHUNK,
+                 checkpoint: DecodeCheckpoint|None = None) -> None:
+        self.source = source
+        self.sink = sink
+        self.chunk_size = chunk_size
+        self.offset = 0
+        self._read_header()
+        if checkpoint is None:
+            self.decoded_count = 0
+            self._fill(self.limits.word_length)
+            self.limits.tag = self.reader.read_int(self.limits.word_length)
+            return
+        self.source.seek(checkpoint.input_position // r.BYTE_SIZE)
+        self.offset = checkpoint.input_position // r.BYTE_SIZE
+        self.reader = BitReader(b'')
+        self._fill(checkpoint.input_position % r.BYTE_SIZE)
+        self.reader.position = checkpoint.input_position % r.BYTE_SIZE
+        self.decoded_count = r.BYTE_SIZE*checkpoint.output_position
+        limits = self.limits
+        limits.tag, limits.lower, limits.upper = checkpoint.tag, checkpoint.lower, checkpoint.upper
+        limits.context, limits.e_3_mapping_counter = checkpoint.context, checkpoint.e_3_mapping_counter
+
+    def _read_header(self) -> None:
+        """Read the header from the source, as much of it as it takes, and build the model."""
+        data = b''
+        while True:
+            chunk = self.source.read(r.READ_CHUNK)
+            data += chunk
+            try:
+                flags, markov_order, counts, symbol_count, reader = r.separate_container(data)
+                if flags & (r.FLAG_ADAPTIVE | r.FLAG_BLOCKS | r.FLAG_BYTES) or r.engine_name(flags) != 'arithmetic':
+                    raise ValueError('Only static containers of the arithmetic engine are decoded as a stream.')
+                precision = reader.read_int(r.BYTE_SIZE) if flags & r.FLAG_FIXED else None
+                break
+            except EOFError:
+                if not chunk:
+                    raise
+        self.limits = HotMBitLimits(markov_order, counts, precision=precision)
+        self.symbol_count = symbol_count
+        self.reader = reader
+
+    def _fill(self, bit_count: int) -> None:
+        """Make sure the reader holds bit_count bits, unless the source ends first."""
+        reader = self.reader
+        if reader.remaining >= bit_count:
+            return
+        consumed = reader.position // r.BYTE_SIZE
+        parts = [reader.data[consumed:]]
+        missing = bit_count - reader.remaining
+        while missing > 0 and (chunk := self.source.read(max(r.READ_CHUNK, -(-missing // r.BYTE_SIZE)))):
+            parts.append(chunk)
+            missing -= r.BYTE_SIZE*len(chunk)
+        position = reader.position % r.BYTE_SIZE
+        self.reader = BitReader(b''.join(parts))
+        self.reader.position = position
+        self.offset += consumed
+
+    @property
+    def finished(self) -> bool:
+        """Return whether every bit of the container has been decoded."""
+        return self.decoded_count >= self.symbol_count
+
+    @property
+    def checkpoint(self) -> DecodeCheckpoint:
+        """Return a checkpoint of where decoding is."""
+        limits = self.limits
+        return DecodeCheckpoint(r.BYTE_SIZE*self.offset + self.reader.position, self.decoded_count // r.BYTE_SIZE,
+                                limits.tag, limits.lower, limits.upper, limits.context, limits.e_3_mapping_counter)
+
+    def decode_chunk(self) -> int:
+        """Decode the next chunk into the sink and return how many bytes it has."""
+        symbol_count = min(r.BYTE_SIZE*self.chunk_size, self.symbol_count - self.decoded_count)
+        if symbol_count <= 0:
+            return 0
+        self._fill((symbol_count + 1)*self.limits.word_length)
+        bit_array = self.limits.decode_bits(self.reader, symbol_count, resume=True)
+        self.decoded_count += symbol_count
+        decoded = np.packbits(bit_array.view(np.uint8)).tobytes()
+        self.sink.write(decoded)
+        return len(decoded)
+
+
+def decode_stream(source: BinaryIO, sink: BinaryIO, chunk_size: int = DECODE_CHUNK,
+                  checkpoint: DecodeCheckpoint|None = None,
+                  on_checkpoint: Callable[[DecodeCheckpoint], None]|None = None,
+                  checkpoint_interval: int = CHECKPOINT_INTERVAL) -> int:
+    """
+    Decode a static container from a source into a sink, a chunk at a
+    time, resuming from a checkpoint if one is given, and return how
+    many bytes were written.
+
+    The sink is flushed after every chunk, so whatever reads from it can
+    start before decoding is done. Every checkpoint_interval chunks, and
+    once decoding is done, on_checkpoint is called with a checkpoint
+    taken after the sink was flushed.
+    """
+    decoder = StreamDecoder(source, sink, chunk_size, checkpoint)
+    chunk_count = 0
+    written_count = 0
+    while chunk_length := decoder.decode_chunk():
+        sink.flush()
+        written_count += chunk_length
+        chunk_count += 1
+        if on_checkpoint is not None and (chunk_count % checkpoint_interval == 0 or decoder.finished):
+            on_checkpoint(decoder.checkpoint)
+    return written_count
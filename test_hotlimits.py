@@ -0,0 +1,89 @@
+"""
+Check that HotMBitLimits codes exactly as FastMBitLimits does.
+
+HotMBitLimits repeats the coding loops of FastMBitLimits with a fast
+path of its own, so any change to either has to keep their messages
+bit-identical. Inputs are random runs of bits with different skews,
+coded whole, in chunks and through the streams. Run with pytest.
+"""
+import io
+
+import numpy as np
+import pytest
+
+import stream
+from bitio import BitReader, BitWriter
+from fastlimits import FastMBitLimits
+from hotlimits import HotMBitLimits
+from occurrences import occurrence_counts
+
+SEEDS = range(100)
+STICKINESSES = (0.5, 0.8, 0.95, 0.99, 0.999, 1.0)
+
+
+def _runs(rng: np.random.Generator, size: int, stickiness: float) -> np.ndarray:
+    """Return bits that repeat the previous one with probability stickiness."""
+    flips = (rng.random(size) > stickiness).astype(np.int8)
+    return (np.cumsum(flips) % 2).astype(np.int8)
+
+
+def _case(seed: int) -> tuple[np.random.Generator, np.ndarray, int, np.ndarray, int|None]:
+    """Return a generator, the bits, the order, the counts and the precision of a random case."""
+    rng = np.random.default_rng(seed)
+    bit_array = _runs(rng, int(rng.integers(1, 4000)), float(rng.choice(STICKINESSES)))
+    markov_order = int(rng.integers(0, 7))
+    counts = occurrence_counts(bit_array, markov_order)
+    if rng.random() < 0.3:
+        counts = counts*int(rng.integers(1, 10**6))
+    precision = (None, 32, 64)[int(rng.integers(0, 3))]
+    return rng, bit_array, markov_order, counts, precision
+
+
+def _cuts(rng: np.random.Generator, size: int) -> list[int]:
+    """Return the bounds of a random split of size bits in chunks."""
+    return [0, *sorted(rng.integers(0, size + 1, int(rng.integers(0, 5))).tolist()), size]
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_chunked_coding(seed):
+    rng, bit_array, markov_order, counts, precision = _case(seed)
+    cuts = _cuts(rng, bit_array.size)
+    messages = []
+    for limits_class in (FastMBitLimits, HotMBitLimits):
+        limits = limits_class(markov_order, counts, precision=precision)
+        writer = BitWriter()
+        for start, stop in zip(cuts, cuts[1:]):
+            limits.encode_bits(bit_array[start:stop], writer)
+        limits.finish(writer)
+        messages.append(writer.to_bytes())
+    assert messages[0] == messages[1]
+    assert messages[1] == HotMBitLimits(markov_order, counts, precision=precision).encode(bit_array).to_bytes()
+    limits = HotMBitLimits(markov_order, counts, precision=precision)
+    reader = BitReader(messages[1])
+    cuts = _cuts(rng, bit_array.size)
+    decoded = [limits.decode_bits(reader, stop - start, resume=bool(chunk))
+               for chunk, (start, stop) in enumerate(zip(cuts, cuts[1:]))]
+    assert np.array_equal(np.concatenate(decoded), bit_array)
+
+
+@pytest.mark.parametrize('seed', SEEDS[:20])
+def test_streams(seed, monkeypatch):
+    rng, bit_array, markov_order, _, _ = _case(seed)
+    data = np.packbits(bit_array.view(np.uint8)).tobytes()
+    chunk_size = int(rng.integers(1, 64))
+    containers = []
+    for limits_class in (FastMBitLimits, HotMBitLimits):
+        monkeypatch.setattr(stream, 'HotMBitLimits', limits_class)
+        sink = io.BytesIO()
+        stream.encode_stream(io.BytesIO(data), sink, markov_order, chunk_size)
+        containers.append(sink.getvalue())
+    assert containers[0] == containers[1]
+    decoder = stream.StreamDecoder(io.BytesIO(containers[1]), io.BytesIO(), chunk_size)
+    decoder.decode_chunk()
+    checkpoint = stream.DecodeCheckpoint.from_bytes(decoder.checkpoint.to_bytes())
+    sink = io.BytesIO(decoder.sink.getvalue())
+    sink.seek(0, io.SEEK_END)
+    decoder = stream.StreamDecoder(io.BytesIO(containers[1]), sink, chunk_size, checkpoint)
+    while not decoder.finished:
+        decoder.decode_chunk()
+    assert sink.getvalue() == data
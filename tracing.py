@@ -0,0 +1,85 @@
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+EVENTS = ('symbol', 'e_1', 'e_2', 'e_3')
+
+Tracer = Callable[[str, int, int, int], None]
+
+
+class CodingCounters:
+    """
+    Count what the coding loops of an instrumented coder do.
+
+    Counts add up over every message the coder handles, so a single set
+    of counters can be shared by several coders and exported once, as
+    a dictionary, after they are done. Coded bits are the bits written
+    by the encoder or read by the decoder.
+    """
+    symbols: int
+    coded_bits: int
+    e_1: int
+    e_2: int
+    e_3: int
+    max_e_3_run: int
+    phase_seconds: dict[str, float]
+
+    def __init__(self) -> None:
+        self.symbols = 0
+        self.coded_bits = 0
+        self.e_1 = 0
+        self.e_2 = 0
+        self.e_3 = 0
+        self.max_e_3_run = 0
+        self.phase_seconds = dict()
+
+    def __repr__(self) -> str:
+        return f'CodingCounters({", ".join(f"{key}={value}" for key, value in self.as_dict().items())})'
+
+    @property
+    def bits_per_symbol(self) -> float:
+        """Return how many bits were coded per symbol."""
+        return self.coded_bits/self.symbols if self.symbols else 0.0
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Add the time spent inside the block to a phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def as_dict(self) -> dict[str, int|float|dict[str, float]]:
+        """Return every counter, to export them as metrics."""
+        return {
+            'symbols': self.symbols,
+            'coded_bits': self.coded_bits,
+            'bits_per_symbol': self.bits_per_symbol,
+            'e_1': self.e_1,
+            'e_2': self.e_2,
+            'e_3': self.e_3,
+            'max_e_3_run': self.max_e_3_run,
+            'phase_seconds': dict(self.phase_seconds),
+        }
+
+
+class HistoryTracer:
+    """
+    Record the limits after every coded symbol.
+
+    Can be given as the tracer of a coder to compare the limits of the
+    encoder and the decoder, which is what the historic lists of
+    MBitLimits were kept for.
+    """
+    historic_lower: list[int]
+    historic_upper: list[int]
+
+    def __init__(self) -> None:
+        self.historic_lower = []
+        self.historic_upper = []
+
+    def __call__(self, event: str, lower: int, upper: int, context: int) -> None:
+        if event == 'symbol':
+            self.historic_lower.append(lower)
+            self.historic_upper.append(upper)
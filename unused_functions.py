@@ -1,6 +1,6 @@
 import numpy as np
 
-from encode import DATA_PATH
+from main import DATA_PATH
 
 
 def generate_sequence(size: int, probability_of_zero: float) -> np.ndarray: